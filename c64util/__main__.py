@@ -0,0 +1,56 @@
+#!/bin/env python
+
+import argparse
+import sys
+
+import build
+import catalog
+import diff
+import merge
+import verify
+from schema.car import CarArchiveType
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='c64util', description='c64 os utilities.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='build applications from project manifests', description='generate about.t, menu.m and a .car archive for each project, in a single process.')
+    build.add_arguments(build_parser)
+
+    catalog_parser = subparsers.add_parser('catalog', help='index a collection of archives', description='maintain and query a sqlite index of the headers and members of many .car files.')
+    catalog.add_arguments(catalog_parser)
+
+    verify_parser = subparsers.add_parser('verify', help='check the integrity of archives', description='check the structure and compressed contents of archives, writing one json line per archive.')
+    verify.add_arguments(verify_parser)
+
+    ls_parser = subparsers.add_parser('ls', help='list the contents of archives', description='list the header and members of archives, writing one json line per archive.')
+    verify.add_arguments(ls_parser)
+
+    diff_parser = subparsers.add_parser('diff', help='build an update archive between two releases', description='write an archive containing only the files added or changed between two archives to stdout; stored bytes are copied from the new archive as they are.')
+    diff.add_arguments(diff_parser)
+
+    merge_parser = subparsers.add_parser('merge', help='merge archives into one', description='write an archive combining several archives to stdout; stored bytes are copied from the source archives as they are.')
+    merge.add_arguments(merge_parser)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        if not build.main(args.projects, args.jobs, args.cache_dir):
+            sys.exit(1)
+    elif args.command == 'catalog':
+        catalog.main(args.database, args.action, args.args, args.jobs)
+    elif args.command == 'diff':
+        archive_type = None
+        if args.type:
+            archive_type = CarArchiveType[args.type.upper()]
+        if not diff.main(args.old, args.new, archive_type, args.note):
+            sys.exit(1)
+    elif args.command == 'merge':
+        archive_type = None
+        if args.type:
+            archive_type = CarArchiveType[args.type.upper()]
+        if not merge.main(args.paths, args.conflict, archive_type, args.note):
+            sys.exit(1)
+    elif args.command in ('verify', 'ls'):
+        if not verify.main(args.command, args.paths, args.jobs):
+            sys.exit(1)
@@ -0,0 +1,226 @@
+import collections
+import concurrent.futures
+import datetime
+import io
+import json
+import os
+import sys
+
+from schema.app import ApplicationMenu, ApplicationMetadata
+from schema.cache import CompressionCache
+from schema.car import (
+    CarArchive,
+    CarArchiveType,
+    CarCompressionType,
+    CarDigests,
+    CarRecordType,
+)
+from gen_car import write_archive
+
+
+# a project manifest is a json file describing one application. paths in it
+# are relative to the manifest itself:
+#
+#   {
+#       "name": "example-app",            application name (required)
+#       "version": "0.1",                 application version (required)
+#       "author": "",                     author's name
+#       "year": 2024,                     publication year (default: this year)
+#       "menu": "src/menu.json",          menu definition, generates menu.m
+#       "output": "out",                  where about.t and menu.m are written
+#       "archive": "dist/app.car",        the .car file to generate
+#       "files": ["out/main.o"],          files and directories to archive
+#       "base": "out",                    paths in the archive are relative
+#                                         to this (default: the manifest's
+#                                         directory)
+#       "prefix": "example-app",          path prefix inside the archive
+#                                         (default: the name)
+#       "type": "general",                archive type
+#       "compression": "none",            compression type, or auto
+#       "max_cost": null,                 with auto, see gen_car.py --max-cost
+#       "note": "",                       archive note
+#       "digests": "dist/app.car.digests" per-record digests of the archive
+#       "index": "dist/app.car.json"      index of the archive's sources; if
+#                                         given, unchanged records are copied
+#                                         from the previous archive
+#   }
+#
+# about.t and menu.m are added to the root of the archive (below the prefix)
+# from memory, so the output directory is optional. if the output directory
+# is itself listed in files, the copies just written there are archived
+# instead.
+
+
+def load_project(path):
+    decoder = json.JSONDecoder(object_pairs_hook=collections.OrderedDict)
+    with open(path, 'r') as f:
+        return decoder.decode(f.read())
+
+
+def _find_record(manifest, name):
+    parts = name.split('/')
+    if manifest.root is None or manifest.root.name != parts[0]:
+        return None
+    try:
+        return manifest.get_record(name)
+    except KeyError:
+        return None
+
+
+def build_project(path, jobs=None, cache_dir=None):
+    """
+    generate all the outputs of one application.
+    :param path: path to the project manifest
+    :param jobs: number of processes used for compression
+    :param cache_dir: directory in which to cache compressed file contents
+    :return: list of the paths written
+    """
+    project = load_project(path)
+    for key in ('name', 'version'):
+        if key not in project:
+            raise ValueError(f'missing {key}')
+    project_dir = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        return os.path.join(project_dir, p)
+
+    generated = []
+    metadata = ApplicationMetadata(
+        name=project['name'],
+        version=project['version'],
+        year=project.get('year', datetime.datetime.now().year),
+        author=project.get('author', ''),
+    )
+    buffer = io.BytesIO()
+    metadata.serialize(buffer)
+    generated.append(('about.t', buffer.getvalue()))
+    if 'menu' in project:
+        buffer = io.BytesIO()
+        ApplicationMenu(menu=load_project(resolve(project['menu']))).serialize(buffer)
+        generated.append(('menu.m', buffer.getvalue()))
+
+    written = []
+    if 'output' in project:
+        output_dir = resolve(project['output'])
+        os.makedirs(output_dir, exist_ok=True)
+        for name, data in generated:
+            output_path = os.path.join(output_dir, name)
+            with open(output_path, 'wb') as f:
+                f.write(data)
+            written.append(output_path)
+
+    if 'archive' in project:
+        compression = project.get('compression', 'none')
+        try:
+            compression_type = CarCompressionType.for_writing(compression)
+        except ValueError as e:
+            raise ValueError(f'compression {compression}: {e}')
+        auto = compression_type is None
+        if auto:
+            compression_type = CarCompressionType.NONE
+        # an archive holds a single root, which about.t and menu.m must be
+        # beneath.
+        prefix = project.get('prefix') or project['name']
+        archive_type = project.get('type', 'general')
+        if archive_type.upper() not in CarArchiveType.__members__:
+            raise ValueError(f'unknown archive type {archive_type}')
+        archive = CarArchive(
+            *[ resolve(p) for p in project.get('files', []) ],
+            base_dir=resolve(project.get('base', '.')),
+            prefix=prefix,
+            archive_type=CarArchiveType[archive_type.upper()],
+            note=project.get('note', ''),
+            compression_type=compression_type,
+        )
+        written_paths = set(os.path.normpath(p) for p in written)
+        for name, data in generated:
+            archive_name = '/'.join(
+                [ part for part in prefix.split('/') if part ] + [ name ]
+            )
+            record = _find_record(archive.manifest, archive_name)
+            if record is None:
+                archive.manifest.add_data(
+                    name, data, prefix=prefix, compression_type=compression_type
+                )
+                continue
+            if record.record_type == CarRecordType.DIRECTORY \
+                    or os.path.normpath(record.path) not in written_paths:
+                raise ValueError(
+                    f'{archive_name} is generated, but a different '
+                    'file at that path is also listed in files'
+                )
+        cache = None
+        if cache_dir:
+            cache = CompressionCache(cache_dir)
+        archive_path = resolve(project['archive'])
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        digests = None
+        if 'digests' in project:
+            digests = CarDigests()
+        index_path = None
+        if 'index' in project:
+            index_path = resolve(project['index'])
+        write_archive(
+            archive, output_path=archive_path, auto=auto, jobs=jobs,
+            max_cost=project.get('max_cost'), cache=cache,
+            base_archive=archive_path if index_path else None,
+            index_path=index_path, digests=digests
+        )
+        written.append(archive_path)
+        if index_path is not None:
+            written.append(index_path)
+        if digests is not None:
+            digests_path = resolve(project['digests'])
+            with open(digests_path, 'w') as f:
+                digests.serialize(f)
+            written.append(digests_path)
+    return written
+
+
+def _report(path, e):
+    if isinstance(e, KeyError):
+        print(f'{path}: missing {e}', file=sys.stderr)
+    else:
+        print(f'{path}: {e}', file=sys.stderr)
+
+
+def main(paths, jobs, cache_dir):
+    """
+    build every project, printing the paths written.
+    :return: True if every project was built
+    """
+    ok = True
+    if len(paths) == 1 or (jobs is not None and jobs <= 1):
+        for path in paths:
+            try:
+                written = build_project(path, jobs=jobs, cache_dir=cache_dir)
+            except (KeyError, OSError, ValueError) as e:
+                _report(path, e)
+                ok = False
+                continue
+            for output_path in written:
+                print(output_path)
+        return ok
+    # each application is built by one process; its compression then runs
+    # in that process rather than a pool of its own.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(build_project, path, jobs=1, cache_dir=cache_dir)
+            for path in paths
+        ]
+        for path, future in zip(paths, futures):
+            try:
+                written = future.result()
+            except (KeyError, OSError, ValueError) as e:
+                _report(path, e)
+                ok = False
+                continue
+            for output_path in written:
+                print(output_path)
+    return ok
+
+
+def add_arguments(parser):
+    parser.add_argument('projects', help='paths to project manifests', nargs='+')
+    parser.add_argument('-j', '--jobs', help='number of processes (default cpu count)', type=int)
+    parser.add_argument('--cache-dir', help='directory in which to cache compressed file contents between builds')
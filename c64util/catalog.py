@@ -0,0 +1,222 @@
+import concurrent.futures
+import os
+import sqlite3
+import struct
+import sys
+
+from schema.car import CarReader, CarRecordType
+
+
+# the catalog is a sqlite database describing a collection of archives. an
+# archive is only read again when its size or modification time changes.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    archive_type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    note TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    archive_id INTEGER NOT NULL REFERENCES archives(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    record_type TEXT NOT NULL,
+    compression TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS members_archive ON members(archive_id);
+CREATE INDEX IF NOT EXISTS members_path ON members(path);
+CREATE INDEX IF NOT EXISTS members_name ON members(name);
+CREATE INDEX IF NOT EXISTS members_hash ON members(hash);
+"""
+
+
+def connect(db_path):
+    db = sqlite3.connect(db_path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    return db
+
+
+def find_archives(paths):
+    """
+    expand directories into the .car files beneath them.
+    :param paths: files and/or directories
+    :return: generator of absolute archive paths
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.abspath(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                if f.lower().endswith('.car'):
+                    yield os.path.abspath(os.path.join(root, f))
+
+
+def scan_archive(path):
+    """
+    describe an archive without extracting it.
+    :param path: path to the archive
+    :return: tuple of (header row, list of member rows), or None if the
+        archive could not be read or parsed
+    """
+    try:
+        return _scan_archive(path)
+    except (AssertionError, ValueError, KeyError, struct.error) as e:
+        print(f'{path}: cannot parse archive ({e!r})', file=sys.stderr)
+        return None
+    except OSError as e:
+        print(f'{path}: cannot read archive ({e})', file=sys.stderr)
+        return None
+
+
+def _scan_archive(path):
+    with open(path, 'rb') as f:
+        reader = CarReader(f)
+        header = reader.header
+        t = header.timestamp
+        header_row = (
+            header.archive_type.name.lower(),
+            f'{t.year:04}-{t.month:02}-{t.day:02} {t.hour:02}:{t.minute:02}',
+            header.note,
+        )
+        members = []
+        for path in reader.list():
+            info = reader.stat(path)
+            digest = None
+            # contents stored in an unsupported compression format cannot
+            # be hashed, and are left without one.
+            if info.record_type != CarRecordType.DIRECTORY \
+                    and info.compression_type.supported:
+                digest = reader.hash(path)
+            members.append((
+                path, path.rpartition('/')[2],
+                info.record_type.name.lower(),
+                info.compression_type.name.lower(),
+                info.size, digest,
+            ))
+    return header_row, members
+
+
+def update(db, paths, jobs=None):
+    """
+    bring the catalog up to date with a collection of archives.
+    archives which are new or whose size or modification time changed are
+    scanned, across a pool of processes; archives which no longer exist are
+    dropped. archives which cannot be read or parsed are reported and left
+    out, so that they are retried by the next update.
+    :param db: the catalog connection
+    :param paths: archives and/or directories containing them
+    :param jobs: number of processes used for scanning
+    :return: tuple of (number of archives scanned, number dropped)
+    """
+    known = {
+        path: (archive_id, size, mtime_ns)
+        for archive_id, path, size, mtime_ns
+        in db.execute('SELECT id, path, size, mtime_ns FROM archives')
+    }
+    stale = []
+    for path in find_archives(paths):
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            print(f'{path}: cannot read archive ({e})', file=sys.stderr)
+            continue
+        old = known.get(path)
+        if old is not None and old[1:] == (st.st_size, st.st_mtime_ns):
+            continue
+        stale.append((path, st))
+    gone = [ path for path in known if not os.path.exists(path) ]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(scan_archive, [ path for path, _ in stale ], chunksize=16)
+        with db:
+            for (path, st), result in zip(stale, results):
+                db.execute('DELETE FROM archives WHERE path = ?', (path,))
+                if result is None:
+                    continue
+                header_row, members = result
+                cursor = db.execute(
+                    'INSERT INTO archives '
+                    '(path, size, mtime_ns, archive_type, timestamp, note) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, st.st_size, st.st_mtime_ns) + header_row
+                )
+                archive_id = cursor.lastrowid
+                db.executemany(
+                    'INSERT INTO members '
+                    '(archive_id, path, name, record_type, compression, size, hash) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [ (archive_id,) + member for member in members ]
+                )
+            db.executemany(
+                'DELETE FROM archives WHERE path = ?', [ (path,) for path in gone ]
+            )
+    return len(stale), len(gone)
+
+
+def find(db, pattern):
+    """
+    find the archives containing a file.
+    :param db: the catalog connection
+    :param pattern: a glob matched against member paths; a pattern without
+        a slash is matched against file names only
+    :return: list of (archive path, member path, timestamp)
+    """
+    column = 'm.path' if '/' in pattern else 'm.name'
+    return db.execute(
+        'SELECT a.path, m.path, a.timestamp FROM members m '
+        'JOIN archives a ON a.id = m.archive_id '
+        f'WHERE {column} GLOB ? ORDER BY a.timestamp, a.path, m.path',
+        (pattern,)
+    ).fetchall()
+
+
+def versions(db, path):
+    """
+    list the distinct versions of a file across the collection, oldest
+    first.
+    :param db: the catalog connection
+    :param path: the member path, e.g. 'os/settings/about.t'
+    :return: list of (hash, first seen, number of archives, archive paths)
+    """
+    # the stored size is left out: it is the size of the compressed bytes,
+    # which may differ between archives holding the same contents.
+    return db.execute(
+        'SELECT m.hash, MIN(a.timestamp), COUNT(*), '
+        "GROUP_CONCAT(a.path, ' ') FROM members m "
+        'JOIN archives a ON a.id = m.archive_id '
+        'WHERE m.path = ? AND m.hash IS NOT NULL '
+        'GROUP BY m.hash ORDER BY MIN(a.timestamp)',
+        (path.strip('/'),)
+    ).fetchall()
+
+
+def main(db_path, action, args, jobs):
+    db = connect(db_path)
+    try:
+        if action == 'update':
+            scanned, dropped = update(db, args, jobs=jobs)
+            print(f'{scanned} scanned, {dropped} dropped')
+        elif action == 'find':
+            for pattern in args:
+                for row in find(db, pattern):
+                    print('\t'.join(row))
+        elif action == 'versions':
+            for path in args:
+                for row in versions(db, path):
+                    print('\t'.join(str(column) for column in row))
+    finally:
+        db.close()
+
+
+def add_arguments(parser):
+    parser.add_argument('database', help='path to the catalog database')
+    parser.add_argument('action', help='update the catalog from archives or directories, find the archives containing a file, or list the versions of a file', choices=['update', 'find', 'versions'])
+    parser.add_argument('args', help='paths (update), glob patterns (find) or member paths (versions)', nargs='+')
+    parser.add_argument('-j', '--jobs', help='number of processes used for scanning (default cpu count)', type=int)
@@ -0,0 +1,119 @@
+import datetime
+import hashlib
+import sys
+
+from schema.car import (
+    CarArchiveType,
+    CarHeader,
+    CarManifest,
+    CarReader,
+    CarRecordType,
+)
+
+
+def same_file(old, new, path):
+    """
+    decide whether a file is the same in both archives.
+    stored bytes are compared first; only when they were stored differently
+    (e.g. with another compression type) are the contents decompressed.
+    """
+    old_info = old.stat(path)
+    new_info = new.stat(path)
+    if old_info.record_type != new_info.record_type:
+        return False
+    if old_info.compression_type == new_info.compression_type:
+        if old_info.size != new_info.size:
+            return False
+        old_digest = hashlib.blake2b(old.open(path).read(), digest_size=20)
+        new_digest = hashlib.blake2b(new.open(path).read(), digest_size=20)
+        return old_digest.digest() == new_digest.digest()
+    if not (old_info.compression_type.supported
+            and new_info.compression_type.supported):
+        # contents which cannot be decompressed cannot be compared.
+        return False
+    return old.hash(path) == new.hash(path)
+
+
+def compare(old, new):
+    """
+    compare the files of two archives.
+    :param old: a CarReader over the older archive
+    :param new: a CarReader over the newer archive
+    :return: tuple of (added, changed, removed) lists of paths
+    """
+    old_files = set(
+        path for path in old.list()
+        if old.stat(path).record_type != CarRecordType.DIRECTORY
+    )
+    added = []
+    changed = []
+    for path in new.list():
+        if new.stat(path).record_type == CarRecordType.DIRECTORY:
+            continue
+        if path not in old_files:
+            added.append(path)
+        elif not same_file(old, new, path):
+            changed.append(path)
+        old_files.discard(path)
+    return added, changed, sorted(old_files)
+
+
+def build_update(old, new, archive_type=None, note=None):
+    """
+    build an archive holding only the files which were added or changed
+    between two archives. their stored bytes are copied across from the
+    newer archive as they are.
+    :param old: a CarReader over the older archive
+    :param new: a CarReader over the newer archive
+    :param archive_type: the update's archive type (default: that of the
+        newer archive, or restore if it is a general archive, since an
+        update replaces files where they already are)
+    :param note: the update's note (default: that of the newer archive)
+    :return: tuple of (header, manifest, payloads, (added, changed, removed))
+    """
+    added, changed, removed = compare(old, new)
+    if archive_type is None:
+        archive_type = new.header.archive_type
+        if archive_type == CarArchiveType.GENERAL:
+            archive_type = CarArchiveType.RESTORE
+    if note is None:
+        note = new.header.note
+    header = CarHeader(
+        archive_type=archive_type, timestamp=datetime.datetime.utcnow(),
+        note=note
+    )
+    manifest = CarManifest()
+    payloads = {}
+    changed_paths = set(added) | set(changed)
+    # keep the newer archive's order.
+    for path in new.list():
+        if path in changed_paths:
+            manifest.add_member(new, path, payloads)
+    return header, manifest, payloads, (added, changed, removed)
+
+
+def main(old_path, new_path, archive_type, note):
+    with open(old_path, 'rb') as old_file, open(new_path, 'rb') as new_file:
+        old = CarReader(old_file)
+        new = CarReader(new_file)
+        header, manifest, payloads, (added, changed, removed) = \
+            build_update(old, new, archive_type=archive_type, note=note)
+        for label, paths in (('added', added), ('changed', changed), ('removed', removed)):
+            for path in paths:
+                print(f'{label}: {path}', file=sys.stderr)
+        if removed:
+            print('archives cannot delete files; removed files are left in place', file=sys.stderr)
+        if manifest.root is None:
+            print('no files were added or changed', file=sys.stderr)
+            return False
+        header.serialize(sys.stdout.buffer)
+        manifest.serialize(sys.stdout.buffer, payloads=payloads)
+    return True
+
+
+def add_arguments(parser):
+    archive_types = [ t.name.lower() for t in CarArchiveType ]
+    parser.add_argument('old', help='the previous release')
+    parser.add_argument('new', help='the new release')
+    parser.add_argument('-t', '--type', help='archive type (default: that of the new release, or restore)', choices=archive_types)
+    parser.add_argument('-n', '--note', help='a note which will be added to the archive metadata (default: that of the new release)')
@@ -1,41 +1,173 @@
 #!/bin/env python
 
 import argparse
+import os
 import sys
+import tempfile
 
+from schema.cache import CompressionCache
 from schema.car import (
+    CarArchiveIndex,
     CarArchiveType,
+    CarDigests,
     CarCompressionType,
     CarArchive,
+    CarReader,
 )
 
 
-def main(paths, base_dir, path_prefix, archive_type, compression_type, note):
+def write_archive(
+    archive, output_path=None, auto=False, jobs=None, max_cost=None,
+    cache=None, base_archive=None, index_path=None, digests=None
+):
+    """
+    write an archive, copying the stored bytes of unchanged records from a
+    previous build of it where that build's index allows.
+    :param archive: the CarArchive to write
+    :param output_path: where to write the archive (default: stdout); it is
+        written beside this path and renamed into place once complete
+    :param auto: whether to choose each record's compression type
+    :param jobs: number of processes used for compression
+    :param max_cost: with auto, see select_compression()
+    :param cache: optional CompressionCache
+    :param base_archive: path to a previous build of the archive, whose
+        index is expected alongside it
+    :param index_path: where to write the index of the new archive
+    :param digests: optional CarDigests, to which every record's digest is
+        added as it is written
+    """
+    base_index = None
+    base_file = None
+    if base_archive and os.path.exists(base_archive + CarArchiveIndex.SUFFIX):
+        with open(base_archive + CarArchiveIndex.SUFFIX, 'r') as f:
+            base_index = CarArchiveIndex.deserialize(f)
+    index = None
+    if base_index is not None or index_path:
+        index = CarArchiveIndex.build(
+            archive.manifest, base_dir=archive.base_dir, previous=base_index
+        )
+    payloads = {}
+    if base_index is not None and not base_index.describes(base_archive):
+        # the index's source hashes are still good for building the new
+        # index, but the archive was rebuilt since it was written.
+        print(f'{base_archive}: index does not match the archive; rebuilding in full', file=sys.stderr)
+    elif base_index is not None:
+        base_file = open(base_archive, 'rb')
+        reader = CarReader(base_file)
+        payloads = archive.manifest.splice(
+            reader, base_index, index, base_dir=archive.base_dir, auto=auto
+        )
+    if auto:
+        # spliced records keep the compression type they were stored with.
+        payloads.update(archive.manifest.select_compression(
+            base_dir=archive.base_dir, max_cost=max_cost, cache=cache,
+            payloads=payloads
+        ))
+        if index is not None:
+            # record the chosen codecs; the hashes are carried over.
+            index = CarArchiveIndex.build(
+                archive.manifest, base_dir=archive.base_dir, previous=index
+            )
+    if output_path:
+        # write beside the output and rename it into place, so that the
+        # output may also be the base archive.
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(output_path)),
+            prefix='.' + os.path.basename(output_path) + '.'
+        )
+        out = os.fdopen(fd, 'wb')
+    else:
+        out = sys.stdout.buffer
+    try:
+        archive.serialize(
+            out, workers=jobs, cache=cache, payloads=payloads,
+            digests=digests
+        )
+        out.flush()
+        if index_path:
+            index.stamp(out)
+        if output_path:
+            # mkstemp() creates the file private to the user.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+            out.close()
+            os.replace(temp_path, output_path)
+    except BaseException:
+        if output_path:
+            out.close()
+            os.unlink(temp_path)
+        raise
+    finally:
+        if base_file is not None:
+            base_file.close()
+    if index_path:
+        with open(index_path, 'w') as f:
+            index.serialize(f)
+
+
+def main(
+    paths, base_dir, path_prefix, archive_type, compression_type, note,
+    jobs, max_cost, cache_dir, base_archive, index_path, digests_path,
+    digest_algorithm, output_path=None
+):
+    auto = compression_type is None
+    if auto:
+        compression_type = CarCompressionType.NONE
     archive = CarArchive(
         *paths, base_dir=base_dir, prefix=path_prefix,
         compression_type=compression_type,
         archive_type=archive_type,
         note=note
     )
-    archive.serialize(sys.stdout.buffer)
+    cache = None
+    if cache_dir:
+        cache = CompressionCache(cache_dir)
+    digests = None
+    if digests_path:
+        digests = CarDigests(algorithm=digest_algorithm)
+    write_archive(
+        archive, output_path=output_path, auto=auto, jobs=jobs,
+        max_cost=max_cost, cache=cache, base_archive=base_archive,
+        index_path=index_path, digests=digests
+    )
+    if digests_path:
+        with open(digests_path, 'w') as f:
+            digests.serialize(f)
 
 
 if __name__ == "__main__":
     archive_types = [ t.name.lower() for t in CarArchiveType ]
     archive_default = CarArchiveType.GENERAL.name.lower()
-    compression_types = [ t.name.lower() for t in CarCompressionType ]
+    compression_types = [ t.name.lower() for t in CarCompressionType ] + ['auto']
     compression_default = CarCompressionType.NONE.name.lower()
 
     parser = argparse.ArgumentParser(description='generate a .car archive file.')
     parser.add_argument('paths', help='paths to files and/or directories', nargs='*')
+    parser.add_argument('-o', '--output', help='write the archive to this path rather than stdout; it is replaced only once complete, so it may also be the --base-archive')
     parser.add_argument('-b', '--base', help='base directory used to determine path inside archive')
     parser.add_argument('-p', '--prefix', help='path prefix for the root of the archive', default='')
     parser.add_argument('-t', '--type', help='archive type (default general)', choices=archive_types, default=archive_default)
-    parser.add_argument('-c', '--compression', help='compression type (default none)', choices=compression_types, default=compression_default)
+    parser.add_argument('-c', '--compression', help='compression type, or auto to choose per file (default none)', choices=compression_types, default=compression_default)
+    parser.add_argument('--max-cost', help='with -c auto, the most decompression work (6502 cycles per byte) a file may cost', type=int)
     parser.add_argument('-n', '--note', help='a note which will be added to the archive metadata', default='')
+    parser.add_argument('-j', '--jobs', help='number of processes used for compression (default cpu count)', type=int)
+    parser.add_argument('--cache-dir', help='directory in which to cache compressed file contents between builds')
+    parser.add_argument('--base-archive', help='a previous build of this archive; unchanged records are copied from it (requires its index, see --index)')
+    parser.add_argument('--digests', help='write the digest of every record, computed while the archive is written, to this path (conventionally the archive path plus .digests)')
+    parser.add_argument('--digest-algorithm', help='digest algorithm for --digests (default blake2b)', choices=CarDigests.ALGORITHMS, default='blake2b')
+    parser.add_argument('--index', help='write an index of the source files to this path, for use with --base-archive (conventionally the archive path plus .json)')
 
     args = parser.parse_args()
     archive_type = CarArchiveType[args.type.upper()]
-    compression_type = CarCompressionType[args.compression.upper()]
+    try:
+        compression_type = CarCompressionType.for_writing(args.compression)
+    except ValueError as e:
+        parser.error(f'-c {args.compression}: {e}')
 
-    main(args.paths, args.base, args.prefix, archive_type, compression_type, args.note)
+    main(
+        args.paths, args.base, args.prefix, archive_type, compression_type,
+        args.note, args.jobs, args.max_cost, args.cache_dir,
+        args.base_archive, args.index, args.digests, args.digest_algorithm,
+        args.output
+    )
@@ -0,0 +1,53 @@
+#!/bin/env python
+
+import argparse
+import os
+import sys
+
+from schema.disk import (
+    DiskFileType,
+    DiskImageType,
+)
+
+
+def parse_file(arg):
+    """
+    parse a file argument of the form path[=name[,type]], where type is a
+    single letter as in a cbm dos file name (s, p or u).
+    :param arg: the argument
+    :return: tuple of (path, name, file type)
+    """
+    path, _, name = arg.partition('=')
+    file_type = DiskFileType.PRG
+    if not name:
+        name = os.path.basename(path)
+    elif ',' in name:
+        name, _, type_letter = name.rpartition(',')
+        file_type = {
+            'S': DiskFileType.SEQ,
+            'P': DiskFileType.PRG,
+            'U': DiskFileType.USR,
+        }[type_letter[:1].upper()]
+    return path, name, file_type
+
+
+def main(files, image_type, name, disk_id):
+    image = image_type.to_class()(name=name, disk_id=disk_id)
+    for path, file_name, file_type in files:
+        with open(path, 'rb') as f:
+            image.add_file(file_name, f.read(), file_type=file_type)
+    image.serialize(sys.stdout.buffer)
+
+
+if __name__ == "__main__":
+    image_types = [ t.value for t in DiskImageType ]
+
+    parser = argparse.ArgumentParser(description='generate a .d64 or .d81 disk image.')
+    parser.add_argument('files', help='files to write, as path[=name[,type]] (the name defaults to the file name, the type to prg)', nargs='*')
+    parser.add_argument('-t', '--type', help='disk image type (default d64)', choices=image_types, default=DiskImageType.D64.value)
+    parser.add_argument('-n', '--name', help='the disk name', default='')
+    parser.add_argument('-i', '--id', help='the two-character disk id', default='00')
+
+    args = parser.parse_args()
+    files = [ parse_file(arg) for arg in args.files ]
+    main(files, DiskImageType(args.type), args.name, args.id)
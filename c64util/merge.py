@@ -0,0 +1,104 @@
+import collections
+import contextlib
+import datetime
+import sys
+
+from diff import same_file
+from schema.car import (
+    CarArchiveType,
+    CarDirectoryRecord,
+    CarHeader,
+    CarManifest,
+    CarReader,
+    CarRecordType,
+)
+
+
+# what to do when several archives hold a file at the same path. identical
+# copies are never a conflict.
+POLICIES = ('error', 'first', 'last')
+
+
+def merge(readers, policy='error', archive_type=None, note=None):
+    """
+    combine several archives into one. directory trees are merged, and each
+    file's stored bytes are copied from the archive it is taken from as they
+    are, without being extracted.
+    :param readers: CarReaders over the archives, in order
+    :param policy: one of POLICIES: fail on a conflicting file, keep the
+        copy from the first archive holding it, or from the last
+    :param archive_type: the archive type (default: that of the first
+        archive)
+    :param note: the archive note (default: that of the first archive)
+    :return: tuple of (header, manifest, payloads)
+    """
+    if policy not in POLICIES:
+        raise ValueError(policy)
+    # an archive has a single root record, so only archives sharing one
+    # can be merged.
+    roots = sorted(set(reader.list()[0] for reader in readers))
+    if len(roots) > 1:
+        raise ValueError(f'archives have different roots: {", ".join(roots)}')
+    # every path, in order of first appearance, with the reader it is taken
+    # from.
+    chosen = collections.OrderedDict()
+    for reader in readers:
+        for path in reader.list():
+            info = reader.stat(path)
+            other = chosen.get(path)
+            if other is None:
+                chosen[path] = reader
+                continue
+            other_type = other.stat(path).record_type
+            if other_type != info.record_type:
+                raise ValueError(f'{path} is a directory in one archive and a file in another')
+            if info.record_type == CarRecordType.DIRECTORY:
+                continue
+            if same_file(other, reader, path):
+                continue
+            if policy == 'error':
+                raise ValueError(f'{path} differs between archives')
+            if policy == 'last':
+                chosen[path] = reader
+    first = readers[0].header
+    header = CarHeader(
+        archive_type=first.archive_type if archive_type is None else archive_type,
+        timestamp=datetime.datetime.utcnow(),
+        note=first.note if note is None else note,
+    )
+    manifest = CarManifest()
+    payloads = {}
+    for path, reader in chosen.items():
+        if reader.stat(path).record_type != CarRecordType.DIRECTORY:
+            manifest.add_member(reader, path, payloads)
+            continue
+        # directories are added too, so that empty ones are kept.
+        parts = path.split('/')
+        record = CarDirectoryRecord(name=parts[-1])
+        for part in reversed(parts[:-1]):
+            record = CarDirectoryRecord(name=part, children=[record])
+        manifest.merge_record(record)
+    return header, manifest, payloads
+
+
+def main(paths, policy, archive_type, note):
+    with contextlib.ExitStack() as stack:
+        readers = [ CarReader(stack.enter_context(open(path, 'rb'))) for path in paths ]
+        try:
+            header, manifest, payloads = merge(
+                readers, policy=policy, archive_type=archive_type, note=note
+            )
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return False
+        header.serialize(sys.stdout.buffer)
+        manifest.serialize(sys.stdout.buffer, payloads=payloads)
+    return True
+
+
+def add_arguments(parser):
+    archive_types = [ t.name.lower() for t in CarArchiveType ]
+    parser.add_argument('paths', help='the archives to merge, in order', nargs='+')
+    parser.add_argument('-c', '--conflict', help='when archives hold different files at the same path: fail, or keep the first or last (default error)', choices=POLICIES, default='error')
+    parser.add_argument('-t', '--type', help='archive type (default: that of the first archive)', choices=archive_types)
+    parser.add_argument('-n', '--note', help='a note which will be added to the archive metadata (default: that of the first archive)')
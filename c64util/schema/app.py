@@ -1,19 +1,87 @@
-import cbmcodecs2
+import collections
+
+from . import petscii
 
 
-LC_CODEC = 'petscii_c64en_lc'
 NEWLINE = b'\x0d'
 
 
+class CbmLineReader:
+
+    CHUNK_SIZE = 4096
+
+
+    def __init__(self, buffer):
+        """
+        read carriage-return delimited lines from a buffer, a chunk at a
+        time. the underlying buffer is read ahead of the lines returned, so
+        it should not be used directly while this reader is in use.
+        :param buffer: the input buffer
+        """
+        self._buffer = buffer
+        self._data = b''
+        self._pos = 0
+        self._eof = False
+
+
+    def _fill(self):
+        chunk = self._buffer.read(CbmLineReader.CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return
+        self._data = self._data[self._pos:] + chunk
+        self._pos = 0
+
+
+    def readline(self):
+        """
+        read the next line.
+        :return: the line, without its terminating carriage return; empty at
+            the end of the buffer
+        """
+        while True:
+            end = self._data.find(NEWLINE, self._pos)
+            if end >= 0:
+                line = self._data[self._pos:end]
+                self._pos = end + 1
+                return line
+            if self._eof:
+                line = self._data[self._pos:]
+                self._pos = len(self._data)
+                return line
+            self._fill()
+
+
+    def read(self, size):
+        """
+        read raw bytes.
+        :param size: the number of bytes to read
+        :return: up to size bytes
+        """
+        while len(self._data) - self._pos < size and not self._eof:
+            self._fill()
+        data = self._data[self._pos:self._pos+size]
+        self._pos += len(data)
+        return data
+
+
 def cbm_readline(buffer):
-    s = b''
+    if isinstance(buffer, CbmLineReader):
+        return buffer.readline()
+    s = bytearray()
     while (True):
         v = buffer.read(1)
         if not v or v == NEWLINE:
-            return s
+            return bytes(s)
         s += v
 
 
+def _line_reader(buffer):
+    if isinstance(buffer, CbmLineReader):
+        return buffer
+    return CbmLineReader(buffer)
+
+
 
 class ApplicationMenu:
 
@@ -35,10 +103,10 @@ class ApplicationMenu:
         for key, val in menu.items():
             if isinstance(val, dict):
                 size = chr(ord('a')-1+len(val))
-                buffer.write(f'{key};{size}'.encode(LC_CODEC) + NEWLINE)
+                buffer.write(petscii.encode(f'{key};{size}') + NEWLINE)
                 self._serialize(buffer, val)
             else:
-                buffer.write(f'{key}:{val}'.encode(LC_CODEC) + NEWLINE)
+                buffer.write(petscii.encode(f'{key}:{val}') + NEWLINE)
 
 
     def serialize(self, buffer):
@@ -46,9 +114,34 @@ class ApplicationMenu:
         buffer.write(NEWLINE)
 
 
+    @staticmethod
+    def _deserialize(reader, count=None):
+        menu = collections.OrderedDict()
+        # entries are counted as they are read rather than by the size of
+        # the dict, which does not grow when a submenu repeats a key.
+        entries = 0
+        while count is None or entries < count:
+            line = petscii.decode(reader.readline())
+            if not line:
+                if count is not None:
+                    raise ValueError('truncated submenu')
+                break
+            entries += 1
+            if len(line) >= 2 and line[-2] == ';':
+                size = ord(line[-1]) - ord('a') + 1
+                menu[line[:-2]] = ApplicationMenu._deserialize(reader, size)
+                continue
+            key, sep, val = line.rpartition(':')
+            if not sep:
+                raise ValueError(line)
+            menu[key] = val
+        return menu
+
+
     @staticmethod
     def deserialize(buffer):
-        raise NotImplementedError()
+        reader = _line_reader(buffer)
+        return ApplicationMenu(menu=ApplicationMenu._deserialize(reader))
 
 
 class ApplicationMetadata:
@@ -101,17 +194,19 @@ class ApplicationMetadata:
 
 
     def serialize(self, buffer):
-        buffer.write(self.name.encode(LC_CODEC) + NEWLINE)
-        buffer.write(b'\x20' + self.version.encode(LC_CODEC) + NEWLINE)
-        buffer.write(str(self.year).encode(LC_CODEC) + NEWLINE)
-        buffer.write(self.author.encode(LC_CODEC) + NEWLINE)
+        buffer.write(petscii.encode(self.name) + NEWLINE)
+        buffer.write(b'\x20' + petscii.encode(self.version) + NEWLINE)
+        buffer.write(petscii.encode(str(self.year)) + NEWLINE)
+        buffer.write(petscii.encode(self.author) + NEWLINE)
 
 
     @staticmethod
     def deserialize(buffer):
-        name = cbm_readline(buffer).decode(LC_CODEC)
-        buffer.read(1)
-        version = cbm_readline(buffer).decode(LC_CODEC)
-        year_s = cbm_readline(buffer).decode(LC_CODEC)
+        reader = _line_reader(buffer)
+        name = petscii.decode(reader.readline())
+        reader.read(1)
+        version = petscii.decode(reader.readline())
+        year_s = petscii.decode(reader.readline())
         year = int(year_s)
-        author = cbm_readline(buffer).decode(LC_CODEC)
+        author = petscii.decode(reader.readline())
+        return ApplicationMetadata(name=name, version=version, year=year, author=author)
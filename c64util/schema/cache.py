@@ -0,0 +1,126 @@
+import hashlib
+import os
+import tempfile
+
+
+class CompressionCache:
+
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+    # eviction frees space down to this fraction of max_size, so that the
+    # cache directory is not walked again on every put() once it is full.
+    LOW_WATER = 0.9
+
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        """
+        an on-disk cache of compressed file contents, keyed by a hash of the
+        uncompressed contents and the codec (including its version).
+        the least recently used entries are evicted once the cache grows
+        beyond max_size bytes.
+        :param path: the cache directory (created if necessary)
+        :param max_size: the maximum total size of all cached entries
+        """
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._max_size = max_size
+        self._size = sum(size for _, _, size in self._entries())
+
+
+    @property
+    def path(self):
+        return self._path
+
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+
+    @property
+    def size(self):
+        return self._size
+
+
+    @staticmethod
+    def key(data, codec):
+        """
+        derive the cache key for some contents.
+        :param data: the uncompressed contents
+        :param codec: a string naming the codec and its version, e.g. 'lz-1'
+        :return: the cache key
+        """
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        return f'{digest}.{codec}'
+
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+
+    def _entries(self):
+        for root, dirs, files in os.walk(self.path):
+            for f in files:
+                full_path = os.path.join(root, f)
+                try:
+                    st = os.stat(full_path)
+                except FileNotFoundError:
+                    continue
+                yield full_path, st.st_mtime, st.st_size
+
+
+    def get(self, key):
+        """
+        look up a cached entry, marking it as recently used.
+        :param key: the cache key
+        :return: the compressed contents, or None
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                payload = f.read()
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        return payload
+
+
+    def put(self, key, payload):
+        """
+        add an entry to the cache, evicting old entries if necessary.
+        :param key: the cache key
+        :param payload: the compressed contents
+        """
+        entry_path = self._entry_path(key)
+        if os.path.exists(entry_path):
+            os.utime(entry_path)
+            return
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # write to a temporary file first so that concurrent builds never
+        # see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, entry_path)
+        self._size += len(payload)
+        if self._size > self.max_size:
+            self.evict()
+
+
+    def evict(self):
+        """
+        delete the least recently used entries until the cache fits in
+        LOW_WATER of its maximum size.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        if self._size <= self.max_size:
+            return
+        target = int(self.max_size * self.LOW_WATER)
+        for entry_path, _, size in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
@@ -1,10 +1,25 @@
 import abc
-import cbmcodecs2
+import array
 import copy
 import collections
+import collections.abc
+import concurrent.futures
 import datetime
 import enum
+import fnmatch
+import hashlib
+import io
+import json
+import mmap
 import os
+import shutil
+import stat
+import struct
+import sys
+import threading
+import zlib
+
+from . import petscii
 
 
 # this is originally based on gillham's excellent uncar.py
@@ -13,7 +28,6 @@ import os
 
 CAR_MAGIC = 'C64Archive'
 CAR_VERSION = 2
-LC_CODEC = 'petscii_c64en_lc'
 
 
 class CarArchiveType(enum.Enum):
@@ -23,6 +37,12 @@ class CarArchiveType(enum.Enum):
     INSTALL = 2
 
 
+class UnsupportedCompressionError(ValueError):
+    """
+    raised when a record's compression type cannot be encoded or decoded.
+    """
+
+
 class CarCompressionType(enum.Enum):
 
     NONE = 0
@@ -30,6 +50,90 @@ class CarCompressionType(enum.Enum):
     LZ = 2
 
 
+    @property
+    def supported(self):
+        """
+        whether records of this compression type can be encoded and decoded.
+        c64 os's rle and lz formats are not implemented; the encodings in the
+        compression module are this tool's own, so they are neither written
+        nor read under c64 os's type ids.
+        :return: bool
+        """
+        return self == CarCompressionType.NONE
+
+
+    def check_supported(self):
+        if not self.supported:
+            raise UnsupportedCompressionError(
+                f'unsupported compression format: {self.name.lower()}'
+            )
+
+
+    @staticmethod
+    def for_writing(name):
+        """
+        look up the compression type to write records with, as named on the
+        command line or in a project manifest.
+        :param name: a compression type name, or 'auto'
+        :return: the compression type, or None for auto
+        """
+        if name == 'auto':
+            return None
+        compression_type = CarCompressionType[name.upper()]
+        compression_type.check_supported()
+        return compression_type
+
+
+    def compress(self, data):
+        """
+        encode a block of bytes with this compression type.
+        :param data: a bytes-like object
+        :return: the encoded bytes
+        """
+        self.check_supported()
+        return bytes(data)
+
+
+    @property
+    def codec(self):
+        """
+        get a name identifying this compression type and the version of its
+        encoder, e.g. for use as a cache key.
+        :return: codec name
+        """
+        return f'{self.name.lower()}-{CODEC_VERSIONS.get(self, 0)}'
+
+
+    def decompress(self, data):
+        """
+        decode a block of bytes which was encoded with this compression type.
+        :param data: a bytes-like object
+        :return: the decoded bytes
+        """
+        self.check_supported()
+        return bytes(data)
+
+
+# the version of each supported compression type's encoder, bumped whenever
+# its output changes so that cached and spliced payloads are not reused.
+CODEC_VERSIONS = {
+    CarCompressionType.NONE: 0,
+}
+
+# approximate 6502 cycles spent per decompressed byte, beyond a plain copy.
+DECOMPRESSION_COST = {
+    CarCompressionType.NONE: 0,
+    CarCompressionType.RLE: 12,
+    CarCompressionType.LZ: 40,
+}
+
+# files up to this size are trial-compressed in full when choosing a
+# compression type. larger files are estimated from evenly spaced blocks.
+AUTO_TRIAL_SIZE = 16 * 1024
+AUTO_SAMPLE_BLOCKS = 8
+AUTO_SAMPLE_BLOCK_SIZE = 2 * 1024
+
+
 class CarRecordType(enum.Enum):
 
     PRGFILE = 0x50
@@ -49,7 +153,13 @@ class CarRecordType(enum.Enum):
 
 class CarRecord(abc.ABC):
 
+    __slots__ = ('_record_type', '_compression_type', '_name')
+
     MAX_NAME_SIZE = 15
+    # record type, lock byte?, size (low 16 bits), size (high 8 bits), name,
+    # ???, compression type
+    HEADER = struct.Struct('<BBHB15sBB')
+    HEADER_SIZE = HEADER.size
 
 
     @property
@@ -119,22 +229,25 @@ class CarRecord(abc.ABC):
 
     @staticmethod
     @abc.abstractmethod
-    def _deserialize(buffer, size, record_type, compression_type, base_dir, name):
+    def _deserialize(
+        buffer, size, record_type, compression_type, base_dir, name,
+        digests=None, path=''
+    ):
         raise NotImplementedError()
 
 
-    def _serialize(self, buffer):
-        record_type_bytes = self.record_type.value.to_bytes(1, 'little')
-        buffer.write(record_type_bytes)
-        buffer.write(b'\0') # lock byte?
-        size_bytes = self.size.to_bytes(3, 'little')
-        buffer.write(size_bytes)
-        name_bytes = self.name.encode(LC_CODEC).ljust(CarRecord.MAX_NAME_SIZE, b'\xA0')
-        buffer.write(name_bytes)
-        buffer.write(b'\0') # ???
-        compression_type = self.compression_type.value
-        compression_bytes = compression_type.to_bytes(1, 'little')
-        buffer.write(compression_bytes)
+    def _serialize(self, buffer, size=None, name_bytes=None):
+        if size is None:
+            size = self.size
+        if name_bytes is None:
+            name_bytes = petscii.encode(self.name)
+        if len(name_bytes) > CarRecord.MAX_NAME_SIZE:
+            raise ValueError(f'record name too long: {self.name!r}')
+        name_bytes = name_bytes.ljust(CarRecord.MAX_NAME_SIZE, b'\xA0')
+        buffer.write(CarRecord.HEADER.pack(
+            self.record_type.value, 0, size & 0xFFFF, size >> 16,
+            name_bytes, 0, self.compression_type.value
+        ))
 
 
     @abc.abstractmethod
@@ -148,40 +261,81 @@ class CarRecord(abc.ABC):
 
 
     @staticmethod
-    def deserialize(buffer, base_dir=None):
+    def _parse_header(data, offset=0):
+        """
+        parse the fixed-size header which precedes every record.
+        :param data: a bytes-like object holding a header
+        :param offset: the position of the header within data
+        :return: tuple of (record type, size, name, compression type)
+        """
+        record_type, size, name_bytes, compression_type = \
+            CarRecord._unpack_header(data, offset)
+        name = petscii.decode(name_bytes)
+        _check_name(name)
+        return record_type, size, name, compression_type
+
+
+    @staticmethod
+    def _unpack_header(data, offset=0):
+        """
+        as _parse_header(), but leave the name undecoded.
+        :return: tuple of (record type, size, name bytes, compression type)
+        """
+        if len(data) - offset < CarRecord.HEADER_SIZE:
+            raise ValueError('truncated record header')
+        record_type_val, _, size_lo, size_hi, name_bytes, _, compression_val = \
+            CarRecord.HEADER.unpack_from(data, offset)
+        size = size_lo | (size_hi << 16)
+        record_type = CarRecordType(record_type_val)
+        compression_type = CarCompressionType(compression_val)
+        return record_type, size, name_bytes.rstrip(b'\xA0'), compression_type
+
+
+    @staticmethod
+    def _read_header(buffer):
+        """
+        read the fixed-size header which precedes every record.
+        :param buffer: the input buffer
+        :return: tuple of (record type, size, name, compression type)
+        """
+        return CarRecord._parse_header(buffer.read(CarRecord.HEADER_SIZE))
+
+
+    @staticmethod
+    def deserialize(buffer, base_dir=None, digests=None, parent=''):
         """
         read in cbm-encoded binary from a buffer and parse it into a record.
         the record's contents will be extracted to the filesystem.
         :param buffer: the output buffer
         :param base_dir: the location in which to extract contents.
+        :param digests: optional CarDigests, to which the digest of every
+            file's stored bytes is added as they are read
+        :param parent: the path of the enclosing directory inside the archive
         """
         if base_dir is None:
             base_dir = os.getcwd()
-        record_type_bytes = buffer.read(1)
-        record_type_val = int.from_bytes(record_type_bytes, 'little')
-        buffer.read(1) # lock byte?
-        size_bytes = buffer.read(3)
-        size = int.from_bytes(size_bytes, 'little')
-        name_bytes = buffer.read(CarRecord.MAX_NAME_SIZE)
-        name = name_bytes.rstrip(b'\xA0').decode(LC_CODEC)
-        buffer.read(1) # ???
-        compression_bytes = buffer.read(1)
-        compression_val = int.from_bytes(compression_bytes, 'little')
-        record_type = CarRecordType(record_type_val)
-        compression_type = CarCompressionType(compression_val)
+        record_type, size, name, compression_type = CarRecord._read_header(buffer)
         return record_type.to_class()._deserialize(
-            buffer, size, record_type, compression_type, base_dir, name
+            buffer, size, record_type, compression_type, base_dir, name,
+            digests=digests, path=_archive_path(parent, name)
         )
 
 
 # TODO this should be abstract
 class CarFileRecord(CarRecord):
 
+    __slots__ = ('_path', '_size', '_data')
+
+
     @property
     def size(self):
         """
         get the size of this file, in bytes
         """
+        if self._data is not None:
+            return len(self._data)
+        if self._size is not None:
+            return self._size
         return os.path.getsize(self.path)
 
 
@@ -193,6 +347,34 @@ class CarFileRecord(CarRecord):
     @path.setter
     def path(self, value):
         self._path = value
+        self._size = None
+
+
+    @property
+    def data(self):
+        """
+        get the in-memory contents of this file, if it has any. records with
+        in-memory contents never touch the filesystem when serialized.
+        :return: a bytes-like object, or None
+        """
+        return self._data
+
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+
+    def source_path(self, base_dir):
+        """
+        get the location of this record's contents on the filesystem.
+        :param base_dir: the directory containing this record's file, used
+            when the record has no path of its own
+        :return: filesystem path
+        """
+        if self.path:
+            return self.path
+        return os.path.join(base_dir, self.name)
 
 
     def to_dict(self):
@@ -210,40 +392,103 @@ class CarFileRecord(CarRecord):
             return False
         if self.path != other.path:
             return False
+        if self.data != other.data:
+            return False
         if self.compression_type != other.compression_type:
             return False
         return True
 
 
-    def serialize(self, buffer, base_dir=None, follow_symlinks=False):
+    def serialize(
+        self, buffer, base_dir=None, follow_symlinks=False, payloads=None,
+        digests=None, parent='', name_bytes=None
+    ):
+        """
+        convert this record to cbm-encoded binary and write it to a buffer.
+        :param buffer: the output buffer
+        :param base_dir: the directory containing this record's file
+        :param payloads: optional mapping of filesystem path to the bytes to
+            store for that file (already compressed), either as a bytes-like
+            object or as a stream such as a CarMemberStream
+        :param digests: optional CarDigests, to which the digest of the
+            stored bytes is added as they are written
+        :param parent: the path of the enclosing directory inside the archive
+        :param name_bytes: this record's name, already encoded as petscii
+        """
         # TODO symlinks
         assert follow_symlinks == False
-        # TODO compression
-        assert self.compression_type == CarCompressionType.NONE
         if base_dir is None:
             base_dir = os.getcwd()
-        super()._serialize(buffer)
-        full_path = os.path.join(base_dir, self.name)
-        with open(full_path, 'rb') as f:
-            while True:
-                chunk = f.read(64)
-                if not chunk:
-                    break
-                buffer.write(chunk)
+        full_path = self.source_path(base_dir)
+        tap = None
+        if digests is not None:
+            tap = digests.hasher()
+        payload = None
+        if payloads is not None:
+            payload = payloads.get(full_path)
+        if isinstance(payload, io.IOBase):
+            size = payload.seek(0, os.SEEK_END)
+            payload.seek(0)
+            super()._serialize(buffer, size=size, name_bytes=name_bytes)
+            _copy_stream(payload, buffer, size, tap=tap)
+        elif self.compression_type == CarCompressionType.NONE and payload is None:
+            super()._serialize(buffer, name_bytes=name_bytes)
+            if self.data is not None:
+                buffer.write(self.data)
+                if tap is not None:
+                    tap.update(self.data)
+            else:
+                with open(full_path, 'rb') as f:
+                    _copy_stream(f, buffer, self.size, tap=tap)
+        else:
+            # the record size is the number of bytes stored in the archive,
+            # so the contents must be compressed before the header can be
+            # written.
+            if payload is not None:
+                data = payload
+            else:
+                data = _compress_source(full_path, self.compression_type, self.data)
+            super()._serialize(buffer, size=len(data), name_bytes=name_bytes)
+            buffer.write(data)
+            if tap is not None:
+                tap.update(data)
+        if tap is not None:
+            digests.add(_archive_path(parent, self.name), tap)
 
 
     @staticmethod
-    def _deserialize(buffer, size, record_type, compression_type, base_dir, name):
-        # TODO compression
-        assert compression_type == CarCompressionType.NONE
+    def _deserialize(
+        buffer, size, record_type, compression_type, base_dir, name,
+        digests=None, path=''
+    ):
         full_path = os.path.join(base_dir, name)
+        tap = None
+        if digests is not None:
+            tap = digests.hasher()
+        if compression_type != CarCompressionType.NONE:
+            data = buffer.read(size)
+            if len(data) != size:
+                raise ValueError()
+            if tap is not None:
+                tap.update(data)
+                digests.add(path, tap)
+            with open(full_path, 'wb') as f:
+                f.write(compression_type.decompress(data))
+            return record_type.to_class()(
+                compression_type=compression_type,
+                name=name, path=full_path
+            )
         with open(full_path, 'wb') as f:
             while size:
                 chunk = buffer.read(min(64, size))
                 if not chunk:
                     raise ValueError()
                 f.write(chunk)
+                if tap is not None:
+                    tap.update(chunk)
                 size -= len(chunk)
+        if tap is not None:
+            digests.add(path, tap)
         return record_type.to_class()(
             compression_type=compression_type,
             name=name, path=full_path
@@ -252,53 +497,72 @@ class CarFileRecord(CarRecord):
 
 class CarSeqFileRecord(CarFileRecord):
 
-    def __init__(self, compression_type=CarCompressionType.NONE, name='', path=''):
+    __slots__ = ()
+
+
+    def __init__(
+        self, compression_type=CarCompressionType.NONE, name='', path='',
+        size=None, data=None
+    ):
         self._record_type = CarRecordType.SEQFILE
         self._compression_type = compression_type
         self._name = name
         self._path = path
+        self._size = size
+        self._data = data
 
 
 
 class CarPrgFileRecord(CarFileRecord):
 
-    def __init__(self, compression_type=CarCompressionType.NONE, name='', path=''):
+    __slots__ = ()
+
+
+    def __init__(
+        self, compression_type=CarCompressionType.NONE, name='', path='',
+        size=None, data=None
+    ):
         self._record_type = CarRecordType.PRGFILE
         self._compression_type = compression_type
         self._name = name
         self._path = path
+        self._size = size
+        self._data = data
 
 
 
 class CarDirectoryRecord(CarRecord):
 
+    __slots__ = ('_children',)
+
+
     def __init__(self, name='', children=[]):
         self._record_type = CarRecordType.DIRECTORY
         self._compression_type = CarCompressionType.NONE
         self._name = name
-        self._children = []
+        # children are keyed by name, in the order they were added.
+        self._children = collections.OrderedDict()
         self.add_children(children)
 
 
     @property
     def size(self):
-        return len(self.children)
+        return len(self._children)
 
 
     @property
     def children(self):
-        return self._children
+        return self._children.values()
 
 
     def get_child(self, name):
-        for child in self.children:
-            if child.name == name:
-                return child
-        return None
+        return self._children.get(name)
 
 
     def add_child(self, record):
-        self.children.append(record)
+        if record.name in self._children:
+            raise ValueError(record.name)
+        self._children[record.name] = record
 
 
     def add_children(self, records):
@@ -306,19 +570,25 @@ class CarDirectoryRecord(CarRecord):
             self.add_child(record)
 
 
-    def merge(self, other):
+    def merge(self, other, parent=''):
+        path = _archive_path(parent, self.name)
         if other.name != self.name:
-            raise ValueError()
+            raise ValueError(
+                f'cannot merge {other.name!r} into directory {path!r}'
+            )
         for other_child in other.children:
             child = self.get_child(other_child.name)
+            child_path = _archive_path(path, other_child.name)
             if not child:
                 self.add_child(other_child)
             elif child.record_type != other_child.record_type:
-                raise ValueError()
+                raise ValueError(f'{child_path}: conflicting record types')
             elif child.record_type == CarRecordType.DIRECTORY:
-                child.merge(other_child)
+                child.merge(other_child, parent=path)
             elif child != other_child:
-                raise ValueError()
+                raise ValueError(
+                    f'{child_path}: a different file is already there'
+                )
 
 
     def to_dict(self):
@@ -330,25 +600,40 @@ class CarDirectoryRecord(CarRecord):
         }
 
 
-    def serialize(self, buffer, base_dir=None, follow_symlinks=False):
+    def serialize(
+        self, buffer, base_dir=None, follow_symlinks=False, payloads=None,
+        digests=None, parent='', name_bytes=None
+    ):
         # TODO symlinks
         assert follow_symlinks == False
         if base_dir is None:
             base_dir = os.getcwd()
-        super()._serialize(buffer)
+        super()._serialize(buffer, name_bytes=name_bytes)
         full_path = os.path.join(base_dir, self.name)
-        for child in self.children:
-            child.serialize(buffer, base_dir=full_path, follow_symlinks=False)
+        path = _archive_path(parent, self.name)
+        # the children's names are encoded in a single translation.
+        names = petscii.encode_all(child.name for child in self.children)
+        for child, child_name in zip(self.children, names):
+            child.serialize(
+                buffer, base_dir=full_path, follow_symlinks=False,
+                payloads=payloads, digests=digests, parent=path,
+                name_bytes=child_name
+            )
 
 
     @staticmethod
-    def _deserialize(buffer, size, record_type, compression_type, base_dir, name):
+    def _deserialize(
+        buffer, size, record_type, compression_type, base_dir, name,
+        digests=None, path=''
+    ):
         full_path = os.path.join(base_dir, name)
         if not os.path.exists(full_path):
             os.makedirs(full_path)
         children = []
         for _ in range(size):
-            child = CarRecord.deserialize(buffer, base_dir=full_path)
+            child = CarRecord.deserialize(
+                buffer, base_dir=full_path, digests=digests, parent=path
+            )
             children.append(child)
         return CarDirectoryRecord(name=name, children=children)
 
@@ -356,8 +641,13 @@ class CarDirectoryRecord(CarRecord):
 
 class CarManifest:
 
+    PARALLEL_MIN_RECORDS = 4
+
+
     def __init__(self):
         self._root = None
+        # file records keyed by their filesystem path.
+        self._files = {}
 
 
     @property
@@ -368,28 +658,146 @@ class CarManifest:
     @root.setter
     def root(self, value):
         self._root = value
+        self._files = {}
+        if value is not None:
+            self._index_files(value)
+
+
+    def _index_files(self, record):
+        if record.record_type == CarRecordType.DIRECTORY:
+            for child in record.children:
+                self._index_files(child)
+        elif record.path:
+            self._files.setdefault(record.path, record)
 
 
     def add_file(
-        self, path, prefix='/',
+        self, path, prefix='/', base_dir=None,
         record_type=CarRecordType.PRGFILE,
         compression_type=CarCompressionType.NONE
     ):
         path = os.path.normpath(path)
+        rel_path = path
+        if base_dir is not None:
+            rel_path = os.path.relpath(path, base_dir)
         prefix_parts = [ part for part in prefix.split('/') if part ]
-        path_parts = [ part for part in path.split(os.sep) if part ]
+        path_parts = [ part for part in rel_path.split(os.sep) if part ]
         name = '/'.join(prefix_parts + path_parts)
         record = _build_record(
             name, path,
             record_type=record_type,
             compression_type=compression_type
         )
-        try:
-            self.merge_record(record)
-        except ValueError as e:
-            print(path)
-            print(self.to_dict())
-            raise e
+        self.merge_record(record)
+
+
+    def add_data(
+        self, name, data, prefix='/',
+        record_type=CarRecordType.PRGFILE,
+        compression_type=CarCompressionType.NONE
+    ):
+        """
+        add a file whose contents are held in memory.
+        :param name: the file's path inside the archive, e.g. 'myapp/main.o'
+        :param data: the file's contents, as a bytes-like object
+        :param prefix: path prefix for the root of the archive
+        """
+        prefix_parts = [ part for part in prefix.split('/') if part ]
+        name_parts = [ part for part in name.split('/') if part ]
+        record = _build_record(
+            '/'.join(prefix_parts + name_parts), '',
+            record_type=record_type,
+            compression_type=compression_type,
+            data=data
+        )
+        self.merge_record(record)
+
+
+    def add_tree(
+        self, root, prefix='/', base_dir=None, include=None, exclude=None,
+        record_type=CarRecordType.PRGFILE,
+        compression_type=CarCompressionType.NONE,
+        workers=None
+    ):
+        """
+        add every file beneath a directory in a single pass.
+        each directory is listed once with os.scandir, file sizes are taken
+        from that listing, and the records are built as a tree directly.
+        :param root: the directory to add
+        :param prefix: path prefix for the root of the archive
+        :param base_dir: directory which paths inside the archive are
+            relative to (default: root is used as given)
+        :param include: glob patterns, relative to root; if given, only
+            matching files are added
+        :param exclude: glob patterns, relative to root; matching files and
+            directories are skipped
+        :param workers: if more than one, the subdirectories of root are
+            scanned concurrently by a pool of threads
+        """
+        root = os.path.normpath(root)
+        rel_path = root
+        if base_dir is not None:
+            rel_path = os.path.relpath(root, base_dir)
+        prefix_parts = [ part for part in prefix.split('/') if part ]
+        path_parts = [
+            part for part in rel_path.split(os.sep) if part and part != '.'
+        ]
+        parts = prefix_parts + path_parts
+        if not parts:
+            raise ValueError(root)
+        options = (include or [], exclude or [], record_type, compression_type)
+        if workers is not None and workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                record = _scan_tree(root, parts[-1], '', options, pool)
+        else:
+            record = _scan_tree(root, parts[-1], '', options, None)
+        if record is None:
+            return
+        for name in reversed(parts[:-1]):
+            record = CarDirectoryRecord(name=name, children=[record])
+        self.merge_record(record)
+
+
+    def add_member(self, reader, path, payloads, name=None):
+        """
+        add a file record copied from an existing archive. its stored bytes
+        are spliced in from that archive when the manifest is serialized,
+        without being decompressed or compressed again.
+        :param reader: a CarReader over the source archive
+        :param path: the record's path in the source archive
+        :param payloads: mapping to which the record's payload stream is
+            added, for the payloads argument of serialize()
+        :param name: the record's path in this manifest (default: path)
+        """
+        info = reader.stat(path)
+        if info.record_type == CarRecordType.DIRECTORY:
+            raise IsADirectoryError(path)
+        if name is None:
+            name = info.path
+        parts = [ part for part in name.split('/') if part ]
+        # the record has no file of its own; its path only keys its payload.
+        key = '/'.join(parts)
+        record = info.record_type.to_class()(
+            compression_type=info.compression_type,
+            name=parts[-1], path=key, size=info.size
+        )
+        for part in reversed(parts[:-1]):
+            record = CarDirectoryRecord(name=part, children=[record])
+        self.merge_record(record)
+        payloads[key] = reader.open(path)
+
+
+    @staticmethod
+    def from_tree(root, **kwargs):
+        """
+        build a manifest from every file beneath a directory.
+        see add_tree() for the accepted arguments.
+        :param root: the directory to add
+        :return: the manifest
+        """
+        manifest = CarManifest()
+        manifest.add_tree(root, **kwargs)
+        return manifest
 
 
     def get_record(self, name):
@@ -402,24 +810,34 @@ class CarManifest:
     def merge_record(self, record):
         if record is None:
             return
+        _check_name_sizes(record)
         if self.root is None:
             self.root = record
             return
+        if self.root.name != record.name:
+            # an archive holds a single root record.
+            raise ValueError(
+                f'{record.name}: archive already has the root {self.root.name}'
+            )
         if self.root.record_type != record.record_type:
-            raise ValueError()
+            raise ValueError(f'{record.name}: conflicting record types')
         if record.record_type == CarRecordType.DIRECTORY:
             self.root.merge(record)
         elif self.root != record:
-            raise ValueError()
+            raise ValueError(
+                f'{record.name}: a different file is already there'
+            )
+        # records which were already present are left in place by merge,
+        # and setdefault leaves their index entries alone too.
+        self._index_files(record)
 
 
     def _get_record(self, parts, parent):
-        if not parts:
-            return parent
-        child = parent.get_child(parts[0])
-        if not child:
-            raise KeyError()
-        return _get_record(parts[1:], child)
+        for part in parts:
+            parent = parent.get_child(part)
+            if not parent:
+                raise KeyError()
+        return parent
 
 
     def iterate_records(self, filter_fn=None):
@@ -429,7 +847,7 @@ class CarManifest:
 
     def iterate_files(self, filter_fn=None):
         for record in self.iterate_records():
-            if n.record_type != CarRecordType.DIRECTORY:
+            if record.record_type == CarRecordType.DIRECTORY:
                 continue
             if filter_fn is not None and not filter_fn(record):
                 continue
@@ -437,7 +855,7 @@ class CarManifest:
 
 
     def _iterate_records(self, node, filter_fn):
-        if filter_fn is not None and filter_fn(node):
+        if filter_fn is None or filter_fn(node):
             yield node
         if node.record_type == CarRecordType.DIRECTORY:
             for child in node.children:
@@ -445,10 +863,7 @@ class CarManifest:
 
 
     def get_file(self, path):
-        for file in self.iterate_files():
-            if file.path == path:
-                return file
-        return None
+        return self._files.get(path)
 
 
     def set_file_compression(self, path, compression_type):
@@ -504,19 +919,195 @@ class CarManifest:
 
 
 
-    def serialize(self, buffer, base_dir=None, follow_symlinks=False):
-        self.root.serialize(buffer, base_dir=base_dir, follow_symlinks=follow_symlinks)
+    def _iterate_paths(self, node, base_dir, parent=''):
+        name = f'{parent}/{node.name}' if parent else node.name
+        if node.record_type == CarRecordType.DIRECTORY:
+            full_path = os.path.join(base_dir, node.name)
+        else:
+            full_path = node.source_path(base_dir)
+        yield name, full_path, node
+        if node.record_type == CarRecordType.DIRECTORY:
+            for child in node.children:
+                yield from self._iterate_paths(child, full_path, name)
+
+
+    def select_compression(
+        self, base_dir=None, max_cost=None, cache=None, payloads=None
+    ):
+        """
+        choose a compression type for every file record, based on a trial
+        compression of (a sample of) its contents.
+        :param base_dir: the directory containing the root record
+        :param max_cost: decompression cost budget; see select_compression()
+        :param cache: optional CompressionCache through which trial
+            compressions are looked up and stored
+        :param payloads: optional mapping of filesystem path to contents
+            which are already available, e.g. from splice(); those records
+            keep their compression type
+        :return: mapping of filesystem path to compressed contents, for the
+            files which were trial-compressed in full, suitable for the
+            payloads argument of serialize()
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        available = payloads or {}
+        payloads = {}
+        if self.root is None:
+            return payloads
+        for _, full_path, record in self._iterate_paths(self.root, base_dir):
+            if record.record_type == CarRecordType.DIRECTORY:
+                continue
+            if full_path in available:
+                continue
+            source = full_path if record.data is None else record.data
+            record.compression_type, payload = select_compression(
+                source, max_cost=max_cost, cache=cache
+            )
+            if payload is not None:
+                payloads[full_path] = payload
+        return payloads
+
+
+    def compress(self, base_dir=None, workers=None, cache=None, payloads=None):
+        """
+        compress the contents of every compressed file record up front.
+        when there are enough of them, the work is spread over a pool of
+        processes, one record per task.
+        :param base_dir: the directory containing the root record
+        :param workers: maximum number of processes (default: cpu count)
+        :param cache: optional CompressionCache consulted before compressing
+        :param payloads: optional mapping of filesystem path to contents
+            which are already available, e.g. from splice()
+        :return: mapping of filesystem path to compressed contents
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        payloads = dict(payloads or {})
+        if self.root is None:
+            return payloads
+        jobs = [
+            (full_path, record.compression_type, record.data)
+            for _, full_path, record in self._iterate_paths(self.root, base_dir)
+            if record.record_type != CarRecordType.DIRECTORY
+            and record.compression_type != CarCompressionType.NONE
+            and full_path not in payloads
+        ]
+        if cache is not None:
+            misses = []
+            keys = {}
+            for path, ctype, data in jobs:
+                if data is None:
+                    with open(path, 'rb') as f:
+                        key = cache.key(f.read(), ctype.codec)
+                else:
+                    key = cache.key(data, ctype.codec)
+                payload = cache.get(key)
+                if payload is None:
+                    keys[path] = key
+                    misses.append((path, ctype, data))
+                else:
+                    payloads[path] = payload
+            jobs = misses
+        if workers is None:
+            workers = os.cpu_count() or 1
+        paths = [ path for path, _, _ in jobs ]
+        ctypes = [ ctype for _, ctype, _ in jobs ]
+        datas = [ data for _, _, data in jobs ]
+        if workers <= 1 or len(jobs) < CarManifest.PARALLEL_MIN_RECORDS:
+            results = map(_compress_source, paths, ctypes, datas)
+            payloads.update(zip(paths, results))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(_compress_source, paths, ctypes, datas)
+                payloads.update(zip(paths, results))
+        if cache is not None:
+            for path in paths:
+                cache.put(keys[path], payloads[path])
+        return payloads
+
+
+    def splice(self, reader, base_index, index, base_dir=None, auto=False):
+        """
+        find file records which are unchanged since a previous archive was
+        built, so that their stored bytes can be copied across rather than
+        read and compressed again. the caller should check that base_index
+        describes the archive being read (see CarArchiveIndex.describes()).
+        :param reader: a CarReader over the previous archive
+        :param base_index: the CarArchiveIndex of the previous archive
+        :param index: the CarArchiveIndex of this manifest
+        :param base_dir: the directory containing the root record
+        :param auto: whether compression types are still to be chosen with
+            select_compression(); unchanged records then keep the type they
+            were stored with, so that they need no trial compression
+        :return: mapping of filesystem path to a stream of stored bytes,
+            suitable for the payloads argument of serialize()
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        payloads = {}
+        if self.root is None:
+            return payloads
+        for name, full_path, record in self._iterate_paths(self.root, base_dir):
+            if record.record_type == CarRecordType.DIRECTORY:
+                continue
+            entry = index.entries.get(name)
+            base_entry = base_index.entries.get(name)
+            if entry is None or base_entry is None:
+                continue
+            # the modification time only lets build() skip hashing; it does
+            # not matter whether the contents changed.
+            keys = [ 'size', 'hash' ]
+            if any(entry[key] != base_entry.get(key) for key in keys):
+                continue
+            try:
+                info = reader.stat(name)
+            except KeyError:
+                continue
+            if info.record_type != record.record_type:
+                continue
+            compression_type = record.compression_type
+            if auto:
+                compression_type = info.compression_type
+            if info.compression_type != compression_type:
+                continue
+            # payloads written by an older version of a codec are not reused.
+            if base_entry.get('codec') != compression_type.codec:
+                continue
+            if info.compression_type == CarCompressionType.NONE \
+                    and info.size != entry['size']:
+                continue
+            record.compression_type = compression_type
+            payloads[full_path] = reader.open(name)
+        return payloads
+
+
+    def serialize(
+        self, buffer, base_dir=None, follow_symlinks=False, workers=None,
+        cache=None, payloads=None, digests=None
+    ):
+        payloads = self.compress(
+            base_dir=base_dir, workers=workers, cache=cache, payloads=payloads
+        )
+        self.root.serialize(
+            buffer, base_dir=base_dir, follow_symlinks=follow_symlinks,
+            payloads=payloads, digests=digests
+        )
 
 
     @staticmethod
-    def deserialize(buffer, base_dir=None):
+    def deserialize(buffer, base_dir=None, digests=None):
         manifest = CarManifest()
-        manifest.root = CarRecord.deserialize(buffer, base_dir=base_dir)
+        manifest.root = CarRecord.deserialize(
+            buffer, base_dir=base_dir, digests=digests
+        )
         return manifest
 
 
 class CarTimestamp:
 
+    FORMAT = struct.Struct('<5B')
+
+
     def __init__(self, year=1900, month=0, day=0, hour=0, minute=0):
         self._year = year
         self._month = month
@@ -592,23 +1183,30 @@ class CarTimestamp:
 
 
     def serialize(self, buffer):
-        values = [ self.year - 1900, self.month, self.day, self.hour, self.minute ]
-        for value in values:
-            buffer.write(value.to_bytes(1, 'little'))
+        buffer.write(CarTimestamp.FORMAT.pack(
+            self.year - 1900, self.month, self.day, self.hour, self.minute
+        ))
+
+
+    @staticmethod
+    def unpack(data, offset=0):
+        year, month, day, hour, minute = CarTimestamp.FORMAT.unpack_from(data, offset)
+        return CarTimestamp(
+            year=year+1900, month=month, day=day, hour=hour, minute=minute
+        )
 
 
     @staticmethod
     def deserialize(buffer):
-        fields = ['year', 'month', 'day', 'hour', 'minute']
-        values = buffer.read(len(fields))
-        d = dict(zip(fields, values))
-        d['year'] += 1900
-        return CarTimestamp(**d)
+        return CarTimestamp.unpack(buffer.read(CarTimestamp.FORMAT.size))
 
 
 class CarHeader:
 
     MAX_NOTE_SIZE = 31
+    # archive type, magic, version, timestamp, note
+    FORMAT = struct.Struct('<B10sB5s31s')
+    SIZE = FORMAT.size
 
 
     def __init__(self, archive_type=CarArchiveType.GENERAL, timestamp=datetime.datetime.utcnow(), note=''):
@@ -645,46 +1243,97 @@ class CarHeader:
 
 
     def serialize(self, buffer):
-        buffer.write(self.archive_type.value.to_bytes(1, 'little'))
-        buffer.write(CAR_MAGIC.encode(LC_CODEC))
-        buffer.write(CAR_VERSION.to_bytes(1, 'little'))
-        self.timestamp.serialize(buffer)
-        buffer.write(self.note.encode(LC_CODEC).ljust(CarHeader.MAX_NOTE_SIZE))
+        t = self.timestamp
+        buffer.write(CarHeader.FORMAT.pack(
+            self.archive_type.value,
+            petscii.encode(CAR_MAGIC),
+            CAR_VERSION,
+            CarTimestamp.FORMAT.pack(t.year - 1900, t.month, t.day, t.hour, t.minute),
+            petscii.encode(self.note).ljust(CarHeader.MAX_NOTE_SIZE),
+        ))
 
 
     @staticmethod
-    def deserialize(buffer):
-        a_type = int.from_bytes(buffer.read(1), 'little')
+    def unpack(data, offset=0):
+        """
+        parse an archive header from a block of bytes.
+        :param data: a bytes-like object holding the header
+        :param offset: the position of the header within data
+        :return: the header
+        """
+        if len(data) - offset < CarHeader.SIZE:
+            raise ValueError('truncated archive header')
+        a_type, magic_buff, version, timestamp_buff, note_buff = \
+            CarHeader.FORMAT.unpack_from(data, offset)
+        magic = petscii.decode(magic_buff)
+        if magic != CAR_MAGIC:
+            raise ValueError(f'bad magic {magic!r}')
+        if version != CAR_VERSION:
+            raise ValueError(f'unsupported version {version}')
         archive_type = CarArchiveType(a_type)
-        magic = buffer.read(10).decode(LC_CODEC)
-        version = int.from_bytes(buffer.read(1), 'little')
-        timestamp = CarTimestamp.deserialize(buffer)
-        note_buff = buffer.read(CarHeader.MAX_NOTE_SIZE)
-        note = note_buff.rstrip(b'\0').decode(LC_CODEC)
-        assert magic == CAR_MAGIC
-        assert version == CAR_VERSION
+        timestamp = CarTimestamp.unpack(timestamp_buff)
+        # notes written by serialize() are padded with spaces.
+        note = petscii.decode(note_buff.rstrip(b'\0 '))
         return CarHeader(archive_type=archive_type, timestamp=timestamp, note=note)
 
 
-class CarArchive:
+    @staticmethod
+    def deserialize(buffer):
+        return CarHeader.unpack(buffer.read(CarHeader.SIZE))
 
-    def __init__(self):
-        self._header = CarHeader()
-        self._manifest = CarManifest()
 
+class CarArchive:
 
     def __init__(
         self,
+        *paths,
+        base_dir=None,
+        prefix='',
         archive_type=CarArchiveType.GENERAL,
         timestamp=datetime.datetime.utcnow(),
         note='',
+        record_type=CarRecordType.PRGFILE,
+        compression_type=CarCompressionType.NONE,
     ):
+        """
+        create an archive from files on the filesystem.
+        :param paths: files and/or directories to add
+        :param base_dir: directory which paths inside the archive are
+            relative to (default: the current directory)
+        :param prefix: path prefix for the root of the archive
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
         self._header = CarHeader(
             archive_type=archive_type,
             timestamp=timestamp,
             note=note,
         )
         self._manifest = CarManifest()
+        self._base_dir = base_dir
+        for path in paths:
+            if os.path.isdir(path):
+                self.manifest.add_tree(
+                    path, prefix=prefix, base_dir=base_dir,
+                    record_type=record_type,
+                    compression_type=compression_type
+                )
+                continue
+            self.manifest.add_file(
+                path, prefix=prefix, base_dir=base_dir,
+                record_type=record_type,
+                compression_type=compression_type
+            )
+
+
+    @property
+    def base_dir(self):
+        return self._base_dir
+
+
+    @base_dir.setter
+    def base_dir(self, value):
+        self._base_dir = value
 
 
     @property
@@ -707,44 +1356,1320 @@ class CarArchive:
         self._manifest = value
 
 
-    def serialize(self, buffer, base_dir=None, follow_symlinks=False):
+    def serialize(
+        self, buffer, base_dir=None, follow_symlinks=False, workers=None,
+        cache=None, payloads=None, digests=None
+    ):
+        """
+        write the archive.
+        :param digests: optional CarDigests, filled in with the digest of
+            every file's stored bytes as they are written
+        """
+        if base_dir is None:
+            base_dir = self.base_dir
         self.header.serialize(buffer)
-        self.manifest.serialize(buffer, base_dir=base_dir, follow_symlinks=follow_symlinks)
+        self.manifest.serialize(
+            buffer, base_dir=base_dir, follow_symlinks=follow_symlinks,
+            workers=workers, cache=cache, payloads=payloads, digests=digests
+        )
 
 
     @staticmethod
-    def deserialize(buffer, base_dir=None):
+    def deserialize(buffer, base_dir=None, workers=None, digests=None):
+        """
+        read in an archive, extracting its contents to the filesystem.
+        :param buffer: the input buffer
+        :param base_dir: the location in which to extract contents.
+        :param workers: if more than one, files are written concurrently by
+            a pool of threads (the buffer must be seekable)
+        :param digests: optional CarDigests, filled in with the digest of
+            every file's stored bytes as they are read
+        :return: the archive
+        """
+        if workers is not None and workers > 1:
+            reader = CarReader(buffer)
+            reader.extractall(base_dir=base_dir, workers=workers, digests=digests)
+            archive = CarArchive()
+            archive.header = reader.header
+            archive.manifest = reader.to_manifest(base_dir=base_dir)
+            return archive
         archive = CarArchive()
         archive.header = CarHeader.deserialize(buffer)
-        archive.manifest = CarManifest.deserialize(buffer, base_dir=base_dir)
+        archive.manifest = CarManifest.deserialize(
+            buffer, base_dir=base_dir, digests=digests
+        )
+        return archive
 
 
-def _build_record(
-    name, path,
-    record_type=CarRecordType.PRGFILE,
-    compression_type=CarCompressionType.NONE
-):
-    parts = [ part for part in name.split('/') if part ]
-    head = parts[0]
-    parts = parts[1:]
-    name = '/'.join(parts)
-    assert record_type != CarRecordType.DIRECTORY
-    if not name:
-        return record_type.to_class()(
-            compression_type=compression_type,
-            name=name, path=path
-        )
-    child = _build_record(
-        name, path,
-        record_type=record_type,
-        compression_type=compression_type
-    )
-    return CarDirectoryRecord(name=head, children=[child])
+class CarArchiveIndex:
+
+    SUFFIX = '.json'
+
+
+    def __init__(self, entries=None, archive=None):
+        """
+        a sidecar describing the source files an archive was built from, so
+        that a later build can tell which records are unchanged.
+        entries map each file's path inside the archive to its source size,
+        modification time, content hash and codec (compression type and
+        encoder version).
+        :param entries: initial entries
+        :param archive: the size and modification time of the archive
+            itself, as recorded by stamp()
+        """
+        self._entries = dict(entries or {})
+        self._archive = archive
+
+
+    @property
+    def entries(self):
+        return self._entries
+
+
+    @property
+    def archive(self):
+        return self._archive
+
+
+    def stamp(self, f):
+        """
+        record the size and modification time of the archive this index
+        describes. call this once the archive has been written in full.
+        :param f: the archive's file object; if it is not a regular file
+            (e.g. a pipe), nothing is recorded
+        """
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            self._archive = None
+            return
+        self._archive = { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns }
+
+
+    def describes(self, path):
+        """
+        check that this index was stamped with an archive, and that the
+        archive at path is still that one. an index left behind by an
+        archive which was since rebuilt without one must not be trusted.
+        :param path: path to the archive
+        :return: bool
+        """
+        if self.archive is None:
+            return False
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return self.archive == { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns }
+
+
+    @staticmethod
+    def _hash_file(path):
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(COPY_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+
+    @staticmethod
+    def build(manifest, base_dir=None, previous=None):
+        """
+        describe the source files of a manifest.
+        files whose size and modification time match the previous index are
+        not read again.
+        :param manifest: the CarManifest
+        :param base_dir: the directory containing the root record
+        :param previous: optional index from a previous build
+        :return: the new index
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        index = CarArchiveIndex()
+        if manifest.root is None:
+            return index
+        for name, full_path, record in manifest._iterate_paths(manifest.root, base_dir):
+            if record.record_type == CarRecordType.DIRECTORY:
+                continue
+            if record.data is not None:
+                index.entries[name] = {
+                    'size': len(record.data),
+                    'mtime_ns': None,
+                    'codec': record.compression_type.codec,
+                    'hash': hashlib.blake2b(record.data, digest_size=20).hexdigest(),
+                }
+                continue
+            st = os.stat(full_path)
+            entry = {
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'codec': record.compression_type.codec,
+            }
+            old = None
+            if previous is not None:
+                old = previous.entries.get(name)
+            if old is not None and old['size'] == st.st_size \
+                    and old['mtime_ns'] == st.st_mtime_ns:
+                entry['hash'] = old['hash']
+            else:
+                entry['hash'] = CarArchiveIndex._hash_file(full_path)
+            index.entries[name] = entry
+        return index
+
+
+    def serialize(self, buffer):
+        d = { 'archive': self.archive, 'entries': self.entries }
+        buffer.write(json.dumps(d, indent=2, sort_keys=True))
+
+
+    @staticmethod
+    def deserialize(buffer):
+        d = json.load(buffer)
+        if set(d) != { 'archive', 'entries' }:
+            # an index from before archives were stamped; its entries are
+            # kept, but it describes no archive.
+            return CarArchiveIndex(entries=d)
+        return CarArchiveIndex(entries=d['entries'], archive=d['archive'])
+
+
+class _Crc32:
+
+    def __init__(self):
+        self._value = 0
+
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+
+    def hexdigest(self):
+        return f'{self._value:08x}'
+
+
+class CarDigests:
+
+    ALGORITHMS = ('blake2b', 'crc32')
+    SUFFIX = '.digests'
+
+
+    def __init__(self, algorithm='blake2b', entries=None):
+        """
+        a sidecar of per-record digests, keyed by path inside the archive.
+        digests are taken over each file's stored bytes (its contents, for
+        uncompressed records) while serialize or extraction streams them, so
+        no second pass over the data is needed.
+        :param algorithm: one of ALGORITHMS
+        :param entries: initial entries
+        """
+        if algorithm not in CarDigests.ALGORITHMS:
+            raise ValueError(algorithm)
+        self._algorithm = algorithm
+        self._entries = dict(entries or {})
+
+
+    @property
+    def algorithm(self):
+        return self._algorithm
+
+
+    @property
+    def entries(self):
+        return self._entries
+
+
+    def hasher(self):
+        """
+        start a new digest.
+        :return: an object with update() and hexdigest(), as in hashlib
+        """
+        if self.algorithm == 'crc32':
+            return _Crc32()
+        return hashlib.blake2b(digest_size=20)
+
+
+    def add(self, path, hasher):
+        self._entries[path] = hasher.hexdigest()
+
+
+    def serialize(self, buffer):
+        buffer.write(json.dumps(
+            { 'algorithm': self.algorithm, 'digests': self.entries },
+            indent=2, sort_keys=True
+        ))
+
+
+    @staticmethod
+    def deserialize(buffer):
+        d = json.load(buffer)
+        return CarDigests(algorithm=d['algorithm'], entries=d['digests'])
+
+
+CarMemberInfo = collections.namedtuple(
+    'CarMemberInfo',
+    ['path', 'record_type', 'compression_type', 'size', 'offset'],
+)
+CarMemberInfo.__doc__ = """
+an index entry describing a single record inside an archive.
+for directories, size is the number of children and offset points at the
+first child's header. for files, size is the number of payload bytes stored
+in the archive and offset points at the first of them.
+"""
+
+
+class CarMemberStream(io.RawIOBase):
+
+    def __init__(self, buffer, offset, size):
+        """
+        a read-only, bounded view of a region of an underlying buffer.
+        the underlying buffer is re-positioned before every read, so several
+        views may share one buffer.
+        :param buffer: a seekable binary buffer
+        :param offset: the position of the first byte in the view
+        :param size: the number of bytes in the view
+        """
+        self._buffer = buffer
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+
+    @property
+    def size(self):
+        return self._size
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self._pos
+
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        elif whence != io.SEEK_SET:
+            raise ValueError()
+        if pos < 0:
+            raise ValueError()
+        self._pos = pos
+        return self._pos
+
+
+    def readinto(self, b):
+        remaining = self._size - self._pos
+        count = min(len(b), remaining)
+        if count <= 0:
+            return 0
+        self._buffer.seek(self._offset + self._pos)
+        data = self._buffer.read(count)
+        if len(data) != count:
+            raise ValueError()
+        memoryview(b).cast('B')[:count] = data
+        self._pos += count
+        return count
+
+
+class CarMemberTable(collections.abc.Mapping):
+
+    def __init__(self):
+        """
+        a compact, read-only mapping of path to CarMemberInfo, in archive
+        order. records are stored as parallel arrays (a name table, parent
+        row, type, compression, size and offset) rather than one object per
+        record; CarMemberInfo tuples and full paths are produced on demand.
+        """
+        self._names = []
+        self._parents = array.array('l')
+        self._record_types = bytearray()
+        self._compression_types = bytearray()
+        self._sizes = array.array('L')
+        self._offsets = array.array('Q')
+        # rows sorted by (parent row, name), so that a path is resolved one
+        # component at a time by binary search rather than through a table
+        # of every full path. built on the first lookup.
+        self._order = None
+
+
+    def append(self, parent, name, record_type, compression_type, size, offset):
+        """
+        add a record. records must be added parents first.
+        :param parent: the row of the parent directory, or -1 for the root
+        :param name: the record's name, or its undecoded petscii bytes (see
+            decode_names())
+        :return: the new record's row
+        """
+        row = len(self._names)
+        if isinstance(name, str):
+            name = sys.intern(name)
+        self._names.append(name)
+        self._parents.append(parent)
+        self._record_types.append(record_type.value)
+        self._compression_types.append(compression_type.value)
+        self._sizes.append(size)
+        self._offsets.append(offset)
+        self._order = None
+        return row
+
+
+    def decode_names(self):
+        """
+        decode every name which was appended as petscii bytes, in one batch.
+        """
+        rows = [
+            row for row, name in enumerate(self._names)
+            if not isinstance(name, str)
+        ]
+        names = petscii.decode_all(self._names[row] for row in rows)
+        for row, name in zip(rows, names):
+            self._names[row] = sys.intern(name)
+        self._order = None
+
+
+    def check_names(self):
+        """
+        check that every (decoded) name can safely be used as a path
+        component; see _check_name().
+        """
+        for name in self._names:
+            _check_name(name)
+
+
+    def path(self, row):
+        """
+        get the full path of a record.
+        :param row: the record's row
+        :return: path
+        """
+        parts = []
+        while row >= 0:
+            parts.append(self._names[row])
+            row = self._parents[row]
+        return '/'.join(reversed(parts))
+
+
+    def info(self, row, path=None):
+        """
+        get the index entry of a record.
+        :param row: the record's row
+        :param path: the record's path, if already known
+        :return: CarMemberInfo
+        """
+        if path is None:
+            path = self.path(row)
+        return CarMemberInfo(
+            path=path,
+            record_type=CarRecordType(self._record_types[row]),
+            compression_type=CarCompressionType(self._compression_types[row]),
+            size=self._sizes[row],
+            offset=self._offsets[row],
+        )
+
+
+    def _iter_paths(self):
+        directory_type = CarRecordType.DIRECTORY.value
+        directories = {}
+        for row, name in enumerate(self._names):
+            parent = self._parents[row]
+            path = name if parent < 0 else f'{directories[parent]}/{name}'
+            if self._record_types[row] == directory_type:
+                directories[row] = path
+            yield row, path
+
+
+    def __len__(self):
+        return len(self._names)
+
+
+    def __iter__(self):
+        for _, path in self._iter_paths():
+            yield path
+
+
+    def _child(self, parent, name):
+        """
+        find a record by its parent and name.
+        :param parent: the row of the parent directory, or -1 for the root
+        :param name: the record's name
+        :return: the record's row, or -1
+        """
+        if self._order is None:
+            parents = self._parents
+            names = self._names
+            self._order = array.array('l', sorted(
+                range(len(names)), key=lambda row: (parents[row], names[row])
+            ))
+        order = self._order
+        target = (parent, name)
+        lo = 0
+        hi = len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = order[mid]
+            if (self._parents[row], self._names[row]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order):
+            row = order[lo]
+            if self._parents[row] == parent and self._names[row] == name:
+                return row
+        return -1
+
+
+    def row(self, path):
+        """
+        resolve a path to its record's row, walking it one component at a
+        time.
+        :param path: the record's full path
+        :return: row
+        """
+        if not isinstance(path, str):
+            raise KeyError(path)
+        row = -1
+        for name in path.split('/'):
+            row = self._child(row, name)
+            if row < 0:
+                raise KeyError(path)
+        return row
+
+
+    def __getitem__(self, path):
+        return self.info(self.row(path), path)
+
+
+    def values(self):
+        for row, path in self._iter_paths():
+            yield self.info(row, path)
+
+
+    def items(self):
+        for row, path in self._iter_paths():
+            yield path, self.info(row, path)
+
+
+class CarPayloadStream(io.RawIOBase):
+
+    def __init__(self, buffer, size):
+        """
+        a read-only, forward-only view of the next size bytes of a stream.
+        unlike CarMemberStream, the underlying stream need not be seekable.
+        :param buffer: a binary stream
+        :param size: the number of bytes in the view
+        """
+        self._buffer = buffer
+        self._size = size
+        self._remaining = size
+
+
+    @property
+    def size(self):
+        return self._size
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('payload is no longer available')
+        count = min(len(b), self._remaining)
+        if count <= 0:
+            return 0
+        view = memoryview(b).cast('B')[:count]
+        if hasattr(self._buffer, 'readinto'):
+            count = self._buffer.readinto(view)
+        else:
+            data = self._buffer.read(count)
+            count = len(data)
+            view[:count] = data
+        if not count:
+            raise ValueError('truncated record')
+        self._remaining -= count
+        return count
+
+
+    def skip(self):
+        """
+        discard whatever has not yet been read.
+        """
+        chunk = bytearray(min(self._remaining, COPY_SIZE))
+        while self._remaining:
+            self.readinto(chunk)
+
+
+CarStreamMember = collections.namedtuple(
+    'CarStreamMember',
+    ['path', 'record_type', 'compression_type', 'size', 'payload'],
+)
+CarStreamMember.__doc__ = """
+a record encountered while streaming through an archive.
+for directories, size is the number of children and payload is None. for
+files, size is the number of stored bytes and payload is a CarPayloadStream
+over them, which is only valid until the next record is requested.
+"""
+
+
+def _read_exact(buffer, size):
+    data = buffer.read(size)
+    while len(data) < size:
+        more = buffer.read(size - len(data))
+        if not more:
+            raise ValueError('truncated archive')
+        data += more
+    return data
+
+
+def iter_records(buffer):
+    """
+    stream through the records of an archive in archive order, without
+    seeking or touching the filesystem.
+    the buffer may be a pipe or socket; memory use does not depend on the
+    size of the archive.
+    :param buffer: a binary stream positioned at the root record
+    :return: generator of CarStreamMember
+    """
+    parents = [ ['', 1] ]
+    while parents:
+        parent = parents[-1]
+        if not parent[1]:
+            parents.pop()
+            continue
+        parent[1] -= 1
+        header = _read_exact(buffer, CarRecord.HEADER_SIZE)
+        record_type, size, name, compression_type = CarRecord._parse_header(header)
+        path = f'{parent[0]}/{name}' if parent[0] else name
+        if record_type == CarRecordType.DIRECTORY:
+            yield CarStreamMember(path, record_type, compression_type, size, None)
+            parents.append([path, size])
+            continue
+        payload = CarPayloadStream(buffer, size)
+        try:
+            yield CarStreamMember(path, record_type, compression_type, size, payload)
+        finally:
+            if not payload.closed:
+                payload.skip()
+                payload.close()
+
+
+def iter_members(buffer):
+    """
+    stream through an archive, as iter_records(), skipping the archive
+    header. use CarHeader.deserialize() and iter_records() instead to keep
+    the header.
+    :param buffer: a binary stream positioned at the archive header
+    :return: generator of CarStreamMember
+    """
+    _read_exact(buffer, CarHeader.SIZE)
+    yield from iter_records(buffer)
+
+
+class CarReader:
+
+    MAX_IN_FLIGHT = 64 * 1024 * 1024
+    SCAN_WINDOW = 16 * 1024
+
+
+    def __init__(self, buffer):
+        """
+        index an archive without extracting it.
+        the record headers are scanned once, seeking past file contents, and
+        every record is indexed by its full path inside the archive.
+        :param buffer: a seekable binary buffer positioned at the archive header
+        """
+        self._buffer = buffer
+        self._header = CarHeader.deserialize(buffer)
+        self._index = CarMemberTable()
+        self._scan()
+
+
+    @property
+    def header(self):
+        return self._header
+
+
+    def _window(self, offset):
+        """
+        get a block of the archive to decode headers from, so that runs of
+        consecutive headers (and small files) cost a single read.
+        :param offset: the position of the next header
+        :return: tuple of (bytes-like block, position of the block)
+        """
+        self._buffer.seek(offset)
+        return self._buffer.read(CarReader.SCAN_WINDOW), offset
+
+
+    def _scan(self):
+        buffer = self._buffer
+        offset = buffer.tell()
+        buffer.seek(0, os.SEEK_END)
+        end = buffer.tell()
+        window, window_start = b'', offset
+        # each entry is [row, number of children still to be read, names
+        # seen so far]. the outermost entry stands in for the single root.
+        parents = [ [-1, 1, set()] ]
+        while parents:
+            parent = parents[-1]
+            if not parent[1]:
+                parents.pop()
+                continue
+            parent[1] -= 1
+            pos = offset - window_start
+            if pos < 0 or pos + CarRecord.HEADER_SIZE > len(window):
+                window, window_start = self._window(offset)
+                pos = offset - window_start
+            record_type, size, name, compression_type = \
+                CarRecord._unpack_header(window, pos)
+            offset += CarRecord.HEADER_SIZE
+            if name in parent[2]:
+                raise ValueError(
+                    f'duplicate record name: {petscii.decode(name)!r}'
+                )
+            parent[2].add(name)
+            row = self._index.append(
+                parent[0], name, record_type, compression_type, size, offset
+            )
+            if record_type == CarRecordType.DIRECTORY:
+                parents.append([row, size, set()])
+            else:
+                offset += size
+                if offset > end:
+                    self._index.decode_names()
+                    raise ValueError(f'truncated payload: {self._index.path(row)}')
+        self._index.decode_names()
+        # names become path components when members are extracted, so one
+        # which could climb out of the target directory is refused here.
+        self._index.check_names()
+
+
+    def list(self):
+        """
+        get the full path of every record in the archive, in archive order.
+        :return: list of paths
+        """
+        return list(self._index)
+
+
+    def stat(self, path):
+        """
+        look up a record by its full path inside the archive.
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :return: the record's index entry
+        """
+        return self._index[path.strip('/')]
+
+
+    def read(self, path):
+        """
+        get the contents of a file record, decompressed if necessary.
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :return: the file's contents
+        """
+        info = self.stat(path)
+        data = self.open(path).read()
+        return info.compression_type.decompress(data)
+
+
+    def open(self, path):
+        """
+        get a file-like view of the stored contents of a file record.
+        compressed records are not decompressed; see read().
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :return: a readable, seekable stream
+        """
+        info = self.stat(path)
+        if info.record_type == CarRecordType.DIRECTORY:
+            raise IsADirectoryError(path)
+        return CarMemberStream(self._buffer, info.offset, info.size)
+
+
+    def hash(self, path):
+        """
+        hash the contents of a file record, decompressed, the same way
+        CarArchiveIndex hashes source files.
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :return: hex digest
+        """
+        return hashlib.blake2b(self.read(path), digest_size=20).hexdigest()
+
+
+    def _write_member(self, info, f, tap=None):
+        stream = CarMemberStream(self._buffer, info.offset, info.size)
+        if info.compression_type != CarCompressionType.NONE:
+            data = stream.read()
+            if tap is not None:
+                tap.update(data)
+            f.write(info.compression_type.decompress(data))
+            return
+        if tap is None:
+            shutil.copyfileobj(stream, f, COPY_SIZE)
+            return
+        _copy_stream(stream, f, info.size, tap=tap)
+
+
+    def _read_member(self, info):
+        """
+        get the stored contents of a file record in memory.
+        :param info: the record's index entry
+        :return: a bytes-like object
+        """
+        return CarMemberStream(self._buffer, info.offset, info.size).read()
+
+
+    def _members(self, path):
+        info = self.stat(path)
+        for member in self._index.values():
+            if member.path == info.path or member.path.startswith(info.path + '/'):
+                yield member
+
+
+    def extract(
+        self, path, base_dir=None, workers=None, max_in_flight=None,
+        digests=None
+    ):
+        """
+        extract a single record (and, for directories, everything beneath it)
+        to the filesystem.
+        with more than one worker, every directory is created up front and
+        this thread reads file contents in archive order while a pool of
+        threads decompresses and writes them. at most max_in_flight bytes of
+        contents are held in memory at once.
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :param base_dir: the location in which to extract contents.
+        :param workers: number of threads writing files (default: one, in
+            this thread)
+        :param max_in_flight: memory budget for parallel extraction
+        :param digests: optional CarDigests, filled in with the digest of
+            every file's stored bytes as they are read
+        :return: the extracted path on the filesystem
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        info = self.stat(path)
+        members = list(self._members(path))
+        # refuse before anything is written rather than part-way through.
+        for member in members:
+            if member.record_type != CarRecordType.DIRECTORY:
+                member.compression_type.check_supported()
+        if workers is not None and workers > 1:
+            self._extract_parallel(
+                members, base_dir, workers, max_in_flight, digests
+            )
+            return os.path.join(base_dir, *info.path.split('/'))
+        for member in members:
+            full_path = os.path.join(base_dir, *member.path.split('/'))
+            if member.record_type == CarRecordType.DIRECTORY:
+                os.makedirs(full_path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            tap = None
+            if digests is not None:
+                tap = digests.hasher()
+            with open(full_path, 'wb') as f:
+                self._write_member(member, f, tap=tap)
+            if tap is not None:
+                digests.add(member.path, tap)
+        return os.path.join(base_dir, *info.path.split('/'))
+
+
+    def _extract_parallel(
+        self, members, base_dir, workers, max_in_flight, digests=None
+    ):
+        if max_in_flight is None:
+            max_in_flight = CarReader.MAX_IN_FLIGHT
+        files = []
+        for member in members:
+            full_path = os.path.join(base_dir, *member.path.split('/'))
+            if member.record_type == CarRecordType.DIRECTORY:
+                os.makedirs(full_path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                files.append((member, full_path))
+        budget = _ByteBudget(max_in_flight)
+        futures = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            for member, full_path in files:
+                budget.acquire(member.size)
+                try:
+                    data = self._read_member(member)
+                    if digests is not None:
+                        tap = digests.hasher()
+                        tap.update(data)
+                        digests.add(member.path, tap)
+                    future = pool.submit(
+                        _write_file, full_path, data, member.compression_type
+                    )
+                except BaseException:
+                    budget.release(member.size)
+                    raise
+                future.add_done_callback(
+                    lambda _, size=member.size: budget.release(size)
+                )
+                futures.append(future)
+        for future in futures:
+            future.result()
+
+
+    def extractall(
+        self, base_dir=None, workers=None, max_in_flight=None, digests=None
+    ):
+        """
+        extract every record in the archive to the filesystem.
+        :param base_dir: the location in which to extract contents.
+        :param workers: see extract()
+        :param max_in_flight: see extract()
+        :param digests: see extract()
+        """
+        root = next(iter(self._index))
+        self.extract(
+            root, base_dir=base_dir, workers=workers,
+            max_in_flight=max_in_flight, digests=digests
+        )
+
+
+    def read_all(self, path=None, digests=None):
+        """
+        extract records into memory instead of to the filesystem.
+        :param path: the record to extract, with everything beneath it
+            (default: the whole archive)
+        :param digests: optional CarDigests, filled in with the digest of
+            every file's stored bytes
+        :return: ordered mapping of path inside the archive to the file's
+            (decompressed) contents
+        """
+        if path is None:
+            path = next(iter(self._index))
+        contents = collections.OrderedDict()
+        for member in self._members(path):
+            if member.record_type == CarRecordType.DIRECTORY:
+                continue
+            data = self._read_member(member)
+            if digests is not None:
+                tap = digests.hasher()
+                tap.update(data)
+                digests.add(member.path, tap)
+            contents[member.path] = member.compression_type.decompress(data)
+        return contents
+
+
+    def to_manifest(self, base_dir=None):
+        """
+        build a manifest describing the archive's records as if it had been
+        extracted to base_dir.
+        :param base_dir: the location in which contents are (or would be)
+            extracted.
+        :return: the manifest
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        records = {}
+        root = None
+        for member in self._index.values():
+            parent, _, name = member.path.rpartition('/')
+            if member.record_type == CarRecordType.DIRECTORY:
+                record = CarDirectoryRecord(name=name)
+            else:
+                record = member.record_type.to_class()(
+                    compression_type=member.compression_type, name=name,
+                    path=os.path.join(base_dir, *member.path.split('/'))
+                )
+            records[member.path] = record
+            if parent:
+                records[parent].add_child(record)
+            else:
+                root = record
+        manifest = CarManifest()
+        manifest.root = root
+        return manifest
+
+
+class CarMappedReader(CarReader):
+
+    def __init__(self, f):
+        """
+        index an archive file by mapping it into memory.
+        headers, notes and file contents are exposed as memoryview slices of
+        the mapping, so inspecting or extracting an archive copies nothing
+        beyond what is written out.
+        :param f: a binary file object opened for reading
+        """
+        self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        super().__init__(self._mmap)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        """
+        release the mapping. views previously handed out must be released
+        by the caller first.
+        """
+        self._view.release()
+        self._mmap.close()
+
+
+    @property
+    def note_view(self):
+        """
+        get the raw, padded archive note.
+        :return: memoryview of the note bytes
+        """
+        end = CarHeader.SIZE
+        return self._view[end-CarHeader.MAX_NOTE_SIZE:end]
+
+
+    def header_view(self, path):
+        """
+        get the raw header of a record.
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :return: memoryview of the record header bytes
+        """
+        info = self.stat(path)
+        return self._view[info.offset-CarRecord.HEADER_SIZE:info.offset]
+
+
+    def view(self, path):
+        """
+        get the stored contents of a file record without copying them.
+        :param path: the record's path, e.g. 'myapp/main.o'
+        :return: memoryview of the stored bytes
+        """
+        info = self.stat(path)
+        if info.record_type == CarRecordType.DIRECTORY:
+            raise IsADirectoryError(path)
+        return self._view[info.offset:info.offset+info.size]
+
+
+    def _window(self, offset):
+        return self._view, 0
+
+
+    def _read_member(self, info):
+        return self._view[info.offset:info.offset+info.size]
+
+
+    def _write_member(self, info, f, tap=None):
+        data = self._view[info.offset:info.offset+info.size]
+        if tap is not None:
+            tap.update(data)
+        if info.compression_type != CarCompressionType.NONE:
+            data = info.compression_type.decompress(data)
+        f.write(data)
+
+
+COPY_SIZE = 64 * 1024
+
+
+def _sample(source):
+    """
+    read the part of a file used to estimate how well it compresses.
+    :param source: a filesystem path, or the file's contents
+    :return: tuple of (sample, file size)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = memoryview(source).cast('B')
+        size = len(data)
+        if size <= AUTO_TRIAL_SIZE:
+            return bytes(data), size
+        stride = (size - AUTO_SAMPLE_BLOCK_SIZE) // (AUTO_SAMPLE_BLOCKS - 1)
+        return b''.join(
+            data[i*stride:i*stride+AUTO_SAMPLE_BLOCK_SIZE]
+            for i in range(AUTO_SAMPLE_BLOCKS)
+        ), size
+    size = os.path.getsize(source)
+    with open(source, 'rb') as f:
+        if size <= AUTO_TRIAL_SIZE:
+            return f.read(), size
+        blocks = []
+        stride = (size - AUTO_SAMPLE_BLOCK_SIZE) // (AUTO_SAMPLE_BLOCKS - 1)
+        for i in range(AUTO_SAMPLE_BLOCKS):
+            f.seek(i * stride)
+            blocks.append(f.read(AUTO_SAMPLE_BLOCK_SIZE))
+        return b''.join(blocks), size
+
+
+def select_compression(source, max_cost=None, cache=None):
+    """
+    choose the compression type which stores a file in the fewest bytes.
+    small files are compressed in full with every candidate; large files are
+    judged on a sample of blocks.
+    :param source: the file to examine, as a path or its contents
+    :param max_cost: ignore compression types whose decompression cost, in
+        cycles per byte (see DECOMPRESSION_COST), exceeds this budget
+    :param cache: optional CompressionCache through which trial compressions
+        of whole files are looked up and stored, keyed like any other
+        compressed contents. samples are never cached, since no payload
+        could ever be looked up under a sample's hash.
+    :return: tuple of (the chosen compression type, the file's compressed
+        contents if the trial covered the whole file, otherwise None)
+    """
+    best = CarCompressionType.NONE
+    best_payload = None
+    candidates = [
+        compression_type for compression_type in CarCompressionType
+        if compression_type != CarCompressionType.NONE
+        and compression_type.supported
+        and (max_cost is None or DECOMPRESSION_COST[compression_type] <= max_cost)
+    ]
+    if not candidates:
+        return best, best_payload
+    sample, size = _sample(source)
+    if not sample:
+        return best, best_payload
+    whole = len(sample) == size
+    if not whole:
+        cache = None
+    best_size = len(sample)
+    for compression_type in candidates:
+        trial = None
+        if cache is not None:
+            key = cache.key(sample, compression_type.codec)
+            trial = cache.get(key)
+        if trial is None:
+            trial = compression_type.compress(sample)
+            if cache is not None:
+                cache.put(key, trial)
+        if len(trial) < best_size:
+            best = compression_type
+            best_size = len(trial)
+            best_payload = trial
+    if not whole:
+        # a sample's compressed bytes are no use for the whole file.
+        best_payload = None
+    return best, best_payload
+
+
+def _compress_source(path, compression_type, data=None):
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+    return compression_type.compress(data)
+
+
+def _copy_stream_kernel(src, dst, size):
+    """
+    copy up to size bytes between two file descriptors without passing the
+    data through userspace.
+    :return: the number of bytes copied, which may fall short if the kernel
+        refuses the copy part-way through (or before it starts).
+    """
+    try:
+        in_fd = src.fileno()
+        out_fd = dst.fileno()
+    except (AttributeError, OSError, ValueError):
+        return 0
+    if not stat.S_ISREG(os.fstat(in_fd).st_mode):
+        return 0
+    dst.flush()
+    copied = 0
+    copiers = []
+    if hasattr(os, 'copy_file_range') and stat.S_ISREG(os.fstat(out_fd).st_mode):
+        copiers.append(lambda count: os.copy_file_range(in_fd, out_fd, count))
+    if hasattr(os, 'sendfile'):
+        copiers.append(lambda count: os.sendfile(out_fd, in_fd, None, count))
+    for copier in copiers:
+        try:
+            while copied < size:
+                count = copier(size - copied)
+                if not count:
+                    break
+                copied += count
+        except OSError:
+            continue
+        break
+    if copied and dst.seekable():
+        # the buffered writer does not know the descriptor has moved.
+        dst.seek(0, os.SEEK_CUR)
+    return copied
+
+
+def _copy_stream(src, dst, size, tap=None):
+    """
+    copy exactly size bytes from one binary stream to another.
+    when both ends are real files and the copy is large enough to repay the
+    extra system calls, it happens in the kernel; otherwise a single
+    reusable buffer is filled with readinto and written out.
+    :param src: the input stream
+    :param dst: the output stream
+    :param size: the number of bytes to copy
+    :param tap: optional hash object updated with the bytes as they are
+        copied (the kernel copy is skipped, as it bypasses the tap)
+    """
+    if tap is None and size >= COPY_SIZE:
+        size -= _copy_stream_kernel(src, dst, size)
+    chunk = memoryview(bytearray(min(size, COPY_SIZE)))
+    while size:
+        count = src.readinto(chunk[:min(size, len(chunk))])
+        if not count:
+            raise ValueError()
+        dst.write(chunk[:count])
+        if tap is not None:
+            tap.update(chunk[:count])
+        size -= count
+
+
+def _check_name(name):
+    """
+    refuse a record name which is not a single, ordinary path component,
+    e.g. '..', which would let extraction write outside its target directory.
+    :param name: the decoded record name
+    """
+    if name in ('', '.', '..') or any(
+        sep in name for sep in ('/', os.sep, os.altsep) if sep
+    ):
+        raise ValueError(f'invalid record name: {name!r}')
+
+
+def _check_name_sizes(record, parent=''):
+    """
+    refuse a record whose name, or the name of any record beneath it, does
+    not fit in a record header once encoded; the header would truncate it.
+    :param record: the record to check
+    :param parent: the path of the enclosing directory inside the archive
+    """
+    path = _archive_path(parent, record.name)
+    size = len(petscii.encode(record.name))
+    if size > CarRecord.MAX_NAME_SIZE:
+        raise ValueError(
+            f'{path}: record name is {size} bytes long, '
+            f'at most {CarRecord.MAX_NAME_SIZE} are allowed'
+        )
+    if record.record_type == CarRecordType.DIRECTORY:
+        for child in record.children:
+            _check_name_sizes(child, parent=path)
+
+
+def _archive_path(parent, name):
+    return f'{parent}/{name}' if parent else name
+
+
+def _build_record(
+    name, path,
+    record_type=CarRecordType.PRGFILE,
+    compression_type=CarCompressionType.NONE,
+    data=None
+):
+    parts = [ part for part in name.split('/') if part ]
+    head = parts[0]
+    parts = parts[1:]
+    name = '/'.join(parts)
+    assert record_type != CarRecordType.DIRECTORY
+    if not name:
+        return record_type.to_class()(
+            compression_type=compression_type,
+            name=head, path=path, data=data
+        )
+    child = _build_record(
+        name, path,
+        record_type=record_type,
+        compression_type=compression_type,
+        data=data
+    )
+    return CarDirectoryRecord(name=head, children=[child])
+
+
+class _ByteBudget:
+
+    def __init__(self, limit):
+        """
+        a counting semaphore measured in bytes.
+        a single acquisition larger than the limit is allowed once nothing
+        else is held, so that it cannot block forever.
+        :param limit: the number of bytes which may be held at once
+        """
+        self._limit = limit
+        self._held = 0
+        self._condition = threading.Condition()
+
+
+    def acquire(self, size):
+        with self._condition:
+            while self._held and self._held + size > self._limit:
+                self._condition.wait()
+            self._held += size
+
+
+    def release(self, size):
+        with self._condition:
+            self._held -= size
+            self._condition.notify_all()
+
+
+def _write_file(path, data, compression_type):
+    if compression_type != CarCompressionType.NONE:
+        data = compression_type.decompress(data)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _scan_tree(path, name, rel_path, options, pool):
+    """
+    build the record for a directory and everything beneath it.
+    :param path: the directory on the filesystem
+    :param name: the directory's name inside the archive
+    :param rel_path: the directory's path relative to the scanned root
+    :param options: tuple of (include, exclude, record type, compression type)
+    :param pool: optional executor used to scan subdirectories
+    :return: the directory record, or None if it holds no files
+    """
+    include, exclude, record_type, compression_type = options
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    children = []
+    for entry in entries:
+        entry_rel_path = f'{rel_path}/{entry.name}' if rel_path else entry.name
+        if any(fnmatch.fnmatch(entry_rel_path, pattern) for pattern in exclude):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            args = (entry.path, entry.name, entry_rel_path, options, None)
+            if pool is not None:
+                children.append(pool.submit(_scan_tree, *args))
+            else:
+                children.append(_scan_tree(*args))
+        elif entry.is_file():
+            if include and not any(
+                fnmatch.fnmatch(entry_rel_path, pattern) for pattern in include
+            ):
+                continue
+            children.append(record_type.to_class()(
+                compression_type=compression_type,
+                name=entry.name, path=entry.path,
+                size=entry.stat().st_size
+            ))
+    if pool is not None:
+        children = [
+            child.result() if isinstance(child, concurrent.futures.Future) else child
+            for child in children
+        ]
+    children = [ child for child in children if child is not None ]
+    if not children:
+        return None
+    return CarDirectoryRecord(name=name, children=children)
 
 
 def unpack_paths(paths):
     full_paths = []
     for path in paths:
+        if not os.path.isdir(path):
+            full_paths.append(path)
+            continue
         for root, dirs, files in os.walk(path):
             for f in files:
                 full_paths.append(os.path.join(root, f))
@@ -0,0 +1,239 @@
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# these encodings are this tool's own, not c64 os's rle and lz formats, so
+# archives are never written or read with them (see CarCompressionType).
+
+# run-length encoding uses the packbits scheme. each packet starts with a
+# control byte n:
+#   0..127   the next n+1 bytes are copied literally
+#   129..255 the next byte is repeated 257-n times
+#   128      no-op
+RLE_VERSION = 1
+RLE_MAX_PACKET = 128
+RLE_MIN_RUN = 3
+
+_RUN_PATTERN = re.compile(rb'(.)\1*', re.DOTALL)
+
+
+def _find_runs_numpy(data):
+    """
+    locate every run of identical bytes.
+    run boundaries are found by diffing the whole input as an array.
+    :param data: the bytes to scan
+    :return: tuple of (run starts, run lengths)
+    """
+    array = numpy.frombuffer(data, dtype=numpy.uint8)
+    starts = numpy.flatnonzero(numpy.diff(array)) + 1
+    starts = numpy.concatenate(([0], starts))
+    lengths = numpy.diff(numpy.append(starts, len(array)))
+    # only runs long enough to be worth a repeat packet are interesting.
+    keep = lengths >= RLE_MIN_RUN
+    return starts[keep].tolist(), lengths[keep].tolist()
+
+
+def _find_runs_python(data):
+    """
+    locate every run of identical bytes.
+    :param data: the bytes to scan
+    :return: tuple of (run starts, run lengths)
+    """
+    starts = []
+    lengths = []
+    for match in _RUN_PATTERN.finditer(data):
+        start, end = match.span()
+        if end - start >= RLE_MIN_RUN:
+            starts.append(start)
+            lengths.append(end - start)
+    return starts, lengths
+
+
+def _rle_literals(out, data, start, end):
+    while start < end:
+        count = min(end - start, RLE_MAX_PACKET)
+        out.append(count - 1)
+        out += data[start:start+count]
+        start += count
+
+
+def rle_encode(data):
+    """
+    compress a block of bytes with run-length encoding.
+    :param data: a bytes-like object
+    :return: the encoded bytes
+    """
+    data = bytes(data)
+    if not data:
+        return b''
+    if numpy is not None:
+        starts, lengths = _find_runs_numpy(data)
+    else:
+        starts, lengths = _find_runs_python(data)
+    out = bytearray()
+    pos = 0
+    for start, length in zip(starts, lengths):
+        _rle_literals(out, data, pos, start)
+        value = data[start]
+        pos = start + length
+        while length >= RLE_MIN_RUN:
+            count = min(length, RLE_MAX_PACKET)
+            out.append(257 - count)
+            out.append(value)
+            length -= count
+        # a short tail of the run is folded into the next literal packet.
+        pos -= length
+    _rle_literals(out, data, pos, len(data))
+    return bytes(out)
+
+
+def rle_decode(data):
+    """
+    expand a block of run-length encoded bytes.
+    :param data: a bytes-like object
+    :return: the decoded bytes
+    """
+    data = bytes(data)
+    out = bytearray()
+    pos = 0
+    end = len(data)
+    while pos < end:
+        control = data[pos]
+        pos += 1
+        if control < 128:
+            count = control + 1
+            if pos + count > end:
+                raise ValueError('truncated literal packet')
+            out += data[pos:pos+count]
+            pos += count
+        elif control > 128:
+            if pos >= end:
+                raise ValueError('truncated repeat packet')
+            out += data[pos:pos+1] * (257 - control)
+            pos += 1
+    return bytes(out)
+
+
+# lz compression is a byte-aligned lz77 variant, simple enough to unpack on
+# a 6502. each packet starts with a control byte n:
+#   0..127   the next n+1 bytes are copied literally
+#   128..255 copy (n&127)+3 bytes starting d bytes back in the output, where
+#            d is the following 16-bit little-endian word. the copy may
+#            overlap the bytes it produces.
+LZ_VERSION = 1
+LZ_MAX_LITERALS = 128
+LZ_MIN_MATCH = 3
+LZ_MAX_MATCH = 127 + LZ_MIN_MATCH
+LZ_WINDOW = 0xFFFF
+LZ_MAX_CHAIN = 32
+
+
+def _lz_literals(out, data, start, end):
+    while start < end:
+        count = min(end - start, LZ_MAX_LITERALS)
+        out.append(count - 1)
+        out += data[start:start+count]
+        start += count
+
+
+def _lz_match_length(data, candidate, pos, limit):
+    length = LZ_MIN_MATCH
+    # compare in slices first; python-level byte loops are slow.
+    while length + 16 <= limit and \
+            data[candidate+length:candidate+length+16] == data[pos+length:pos+length+16]:
+        length += 16
+    while length < limit and data[candidate+length] == data[pos+length]:
+        length += 1
+    return length
+
+
+def lz_encode(data):
+    """
+    compress a block of bytes with lz77-style encoding.
+    :param data: a bytes-like object
+    :return: the encoded bytes
+    """
+    data = bytes(data)
+    end = len(data)
+    out = bytearray()
+    chains = {}
+    literal_start = 0
+    pos = 0
+    while pos < end:
+        best_length = 0
+        best_distance = 0
+        limit = min(LZ_MAX_MATCH, end - pos)
+        if limit >= LZ_MIN_MATCH:
+            key = data[pos:pos+LZ_MIN_MATCH]
+            chain = chains.get(key)
+            if chain is None:
+                chain = chains[key] = []
+            for candidate in reversed(chain):
+                distance = pos - candidate
+                if distance > LZ_WINDOW:
+                    break
+                length = _lz_match_length(data, candidate, pos, limit)
+                if length > best_length:
+                    best_length = length
+                    best_distance = distance
+                    if length == limit:
+                        break
+            chain.append(pos)
+            if len(chain) > 2 * LZ_MAX_CHAIN:
+                del chain[:-LZ_MAX_CHAIN]
+        if best_length < LZ_MIN_MATCH:
+            pos += 1
+            continue
+        _lz_literals(out, data, literal_start, pos)
+        out.append(0x80 | (best_length - LZ_MIN_MATCH))
+        out += best_distance.to_bytes(2, 'little')
+        for i in range(pos + 1, min(pos + best_length, end - LZ_MIN_MATCH + 1)):
+            chain = chains.setdefault(data[i:i+LZ_MIN_MATCH], [])
+            chain.append(i)
+            if len(chain) > 2 * LZ_MAX_CHAIN:
+                del chain[:-LZ_MAX_CHAIN]
+        pos += best_length
+        literal_start = pos
+    _lz_literals(out, data, literal_start, end)
+    return bytes(out)
+
+
+def lz_decode(data):
+    """
+    expand a block of lz encoded bytes.
+    :param data: a bytes-like object
+    :return: the decoded bytes
+    """
+    data = bytes(data)
+    out = bytearray()
+    pos = 0
+    end = len(data)
+    while pos < end:
+        control = data[pos]
+        pos += 1
+        if control < 0x80:
+            count = control + 1
+            if pos + count > end:
+                raise ValueError('truncated literal packet')
+            out += data[pos:pos+count]
+            pos += count
+            continue
+        if pos + 2 > end:
+            raise ValueError('truncated match packet')
+        length = (control & 0x7F) + LZ_MIN_MATCH
+        distance = int.from_bytes(data[pos:pos+2], 'little')
+        pos += 2
+        if not distance or distance > len(out):
+            raise ValueError('match distance out of range')
+        start = len(out) - distance
+        if distance >= length:
+            out += out[start:start+length]
+            continue
+        # an overlapping match repeats the last `distance` bytes.
+        pattern = out[start:]
+        out += (pattern * (length // distance + 1))[:length]
+    return bytes(out)
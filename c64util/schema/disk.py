@@ -0,0 +1,731 @@
+import abc
+import collections
+import enum
+import io
+import mmap
+import struct
+
+from . import petscii
+
+
+SECTOR_SIZE = 256
+# the first two bytes of every file sector link to the next one.
+SECTOR_DATA_SIZE = SECTOR_SIZE - 2
+DIR_ENTRY_SIZE = 32
+DIR_ENTRIES_PER_SECTOR = SECTOR_SIZE // DIR_ENTRY_SIZE
+MAX_NAME_SIZE = 16
+DISK_ID_SIZE = 2
+NAME_PAD = 0xA0
+
+
+class DiskImageType(enum.Enum):
+
+    D64 = 'd64'
+    D81 = 'd81'
+
+
+    def to_class(self):
+        if self == DiskImageType.D64:
+            return D64Image
+        if self == DiskImageType.D81:
+            return D81Image
+        raise NotImplementedError()
+
+
+    @staticmethod
+    def from_size(size):
+        """
+        identify an image by its size. images may carry a trailing block of
+        error information, one byte per sector.
+        :param size: the image size in bytes
+        :return: the image type
+        """
+        for image_type in DiskImageType:
+            image_size = image_type.to_class().SIZE
+            if size in (image_size, image_size + image_size // SECTOR_SIZE):
+                return image_type
+        raise ValueError(f'unrecognized disk image size {size}')
+
+
+class DiskFileType(enum.Enum):
+
+    DEL = 0
+    SEQ = 1
+    PRG = 2
+    USR = 3
+    REL = 4
+    # a 1581 partition: a run of whole tracks holding a disk of its own.
+    CBM = 5
+
+
+# set in a directory entry's file type once the file has been closed.
+FILE_CLOSED = 0x80
+
+
+class DiskImage(abc.ABC):
+
+    # next track, next sector, file type, first track, first sector, name,
+    # rel/geos fields, size in blocks. the link is only meaningful in the
+    # first entry of each directory sector.
+    DIR_ENTRY = struct.Struct('<BBBBB16s9sH')
+
+    SIZE = 0
+    TRACKS = 0
+    DIRECTORY_TRACK = 0
+    FIRST_DIRECTORY_SECTOR = 0
+    INTERLEAVE = 1
+    DIRECTORY_INTERLEAVE = 1
+
+
+    def __init__(self, name='', disk_id='00', data=None):
+        """
+        a disk image held entirely in memory. a new image is formatted in a
+        zeroed buffer; files are then laid out into it and the whole image is
+        written out at once by serialize().
+        :param name: the disk name
+        :param disk_id: the two-character disk id
+        :param data: an existing image (a bytearray or writable mmap) to use
+                     instead of formatting a new one
+        """
+        self._offsets = [0]
+        for track in range(1, self.TRACKS + 1):
+            self._offsets.append(self._offsets[-1] + self.sectors(track) * SECTOR_SIZE)
+        if data is None:
+            self._data = bytearray(self.SIZE)
+            self._format(name, disk_id)
+        else:
+            if len(data) != self.SIZE:
+                raise ValueError('image size does not match its type')
+            self._data = data
+
+
+    @property
+    @abc.abstractmethod
+    def image_type(self):
+        pass
+
+
+    @property
+    def size(self):
+        return self.SIZE
+
+
+    @property
+    def data(self):
+        return self._data
+
+
+    @property
+    def name(self):
+        header = self.offset(self.DIRECTORY_TRACK, 0) + self.NAME_OFFSET
+        return _unpad(self._data[header:header + MAX_NAME_SIZE])
+
+
+    @property
+    def disk_id(self):
+        # the id follows the name and two shifted spaces.
+        header = self.offset(self.DIRECTORY_TRACK, 0) + self.NAME_OFFSET + MAX_NAME_SIZE + 2
+        return _unpad(self._data[header:header + DISK_ID_SIZE])
+
+
+    @staticmethod
+    @abc.abstractmethod
+    def sectors(track):
+        """
+        get the number of sectors on a track.
+        :param track: the track number, starting from 1
+        :return: sector count
+        """
+        pass
+
+
+    @abc.abstractmethod
+    def _bam_entry(self, track):
+        """
+        locate a track's entry in the block availability map. an entry is a
+        count of free sectors followed by a bitmap of them, one bit per
+        sector, set when the sector is free.
+        :param track: the track number
+        :return: offset of the entry within the image
+        """
+        pass
+
+
+    @abc.abstractmethod
+    def _format(self, name, disk_id):
+        pass
+
+
+    def offset(self, track, sector):
+        """
+        get the position of a sector within the image.
+        :param track: the track number, starting from 1
+        :param sector: the sector number, starting from 0
+        :return: byte offset
+        """
+        if not 1 <= track <= self.TRACKS or not 0 <= sector < self.sectors(track):
+            raise ValueError(f'illegal track or sector {track}/{sector}')
+        return self._offsets[track - 1] + sector * SECTOR_SIZE
+
+
+    def is_free(self, track, sector):
+        entry = self._bam_entry(track)
+        return bool(self._data[entry + 1 + sector // 8] & (1 << (sector % 8)))
+
+
+    def _set_free(self, track, sector, free):
+        entry = self._bam_entry(track)
+        bit = 1 << (sector % 8)
+        if bool(self._data[entry + 1 + sector // 8] & bit) == free:
+            return
+        self._data[entry + 1 + sector // 8] ^= bit
+        self._data[entry] += 1 if free else -1
+
+
+    def _free_track(self, track):
+        entry = self._bam_entry(track)
+        sectors = self.sectors(track)
+        for i in range((sectors + 7) // 8):
+            bits = min(8, sectors - i * 8)
+            self._data[entry + 1 + i] = (1 << bits) - 1
+        self._data[entry] = sectors
+
+
+    def track_free(self, track):
+        return self._data[self._bam_entry(track)]
+
+
+    @property
+    def free_blocks(self):
+        """
+        get the number of free blocks, not counting the directory track
+        (which only holds directory sectors).
+        """
+        return sum(
+            self.track_free(track) for track in range(1, self.TRACKS + 1)
+            if track != self.DIRECTORY_TRACK
+        )
+
+
+    def _track_order(self):
+        # files are placed as close to the directory track as possible,
+        # working outwards: first towards track 1, then towards the rim.
+        yield from range(self.DIRECTORY_TRACK - 1, 0, -1)
+        yield from range(self.DIRECTORY_TRACK + 1, self.TRACKS + 1)
+
+
+    def _next_free(self, track, sector, interleave):
+        sectors = self.sectors(track)
+        for i in range(sectors):
+            candidate = (sector + interleave + i) % sectors
+            if self.is_free(track, candidate):
+                return candidate
+        return None
+
+
+    def _allocate_chain(self, count):
+        """
+        allocate the sectors for a file.
+        :param count: the number of sectors needed
+        :return: list of (track, sector), in chain order
+        """
+        if count > self.free_blocks:
+            raise ValueError('disk full')
+        chain = []
+        tracks = self._track_order()
+        track = next(tracks)
+        sector = None
+        while len(chain) < count:
+            if not self.track_free(track):
+                track = next(tracks)
+                sector = None
+                continue
+            if sector is None:
+                sector = self._next_free(track, 0, 0)
+            else:
+                sector = self._next_free(track, sector, self.INTERLEAVE)
+            self._set_free(track, sector, False)
+            chain.append((track, sector))
+        return chain
+
+
+    def _iter_directory(self):
+        """
+        walk the directory chain.
+        :return: generator of (sector offset, entry offset)
+        """
+        track, sector = self.DIRECTORY_TRACK, self.FIRST_DIRECTORY_SECTOR
+        seen = set()
+        while track:
+            if (track, sector) in seen:
+                raise ValueError('directory chain loops')
+            seen.add((track, sector))
+            offset = self.offset(track, sector)
+            for i in range(DIR_ENTRIES_PER_SECTOR):
+                yield offset, offset + i * DIR_ENTRY_SIZE
+            track, sector = self._data[offset], self._data[offset + 1]
+
+
+    def _directory_entry(self, name):
+        """
+        find a free directory entry, extending the directory if necessary.
+        :param name: the encoded name of the file being added
+        :return: offset of the entry
+        """
+        free = None
+        last = None
+        for sector_offset, entry in self._iter_directory():
+            last = sector_offset
+            file_type = self._data[entry + 2]
+            if not file_type:
+                if free is None:
+                    free = entry
+            elif self._data[entry + 5:entry + 5 + MAX_NAME_SIZE] == name:
+                raise ValueError(f'file exists: {petscii.decode(name.rstrip(bytes([NAME_PAD])))}')
+        if free is not None:
+            return free
+        sector = self._next_free(
+            self.DIRECTORY_TRACK,
+            (last - self._offsets[self.DIRECTORY_TRACK - 1]) // SECTOR_SIZE,
+            self.DIRECTORY_INTERLEAVE
+        )
+        if sector is None:
+            raise ValueError('directory full')
+        self._set_free(self.DIRECTORY_TRACK, sector, False)
+        self._data[last] = self.DIRECTORY_TRACK
+        self._data[last + 1] = sector
+        offset = self.offset(self.DIRECTORY_TRACK, sector)
+        self._data[offset:offset + 2] = b'\x00\xff'
+        return offset
+
+
+    def add_file(self, name, data, file_type=DiskFileType.PRG):
+        """
+        write a file into the image, allocating its sectors and adding it to
+        the directory.
+        :param name: the file name
+        :param data: the file contents, a bytes-like object
+        :param file_type: the file type
+        """
+        encoded = petscii.encode(name)
+        assert len(encoded) <= MAX_NAME_SIZE
+        encoded = encoded.ljust(MAX_NAME_SIZE, bytes([NAME_PAD]))
+        data = memoryview(data).cast('B')
+        count = max(1, (len(data) + SECTOR_DATA_SIZE - 1) // SECTOR_DATA_SIZE)
+        if count > self.free_blocks:
+            raise ValueError('disk full')
+        # find the directory entry first so that a duplicate name fails
+        # before anything is allocated.
+        entry = self._directory_entry(encoded)
+        chain = self._allocate_chain(count)
+        for i, (track, sector) in enumerate(chain):
+            offset = self.offset(track, sector)
+            chunk = data[i * SECTOR_DATA_SIZE:(i + 1) * SECTOR_DATA_SIZE]
+            if i + 1 < len(chain):
+                self._data[offset:offset + 2] = bytes(chain[i + 1])
+            else:
+                # the last sector links to track 0; its sector byte is the
+                # index of the last byte used.
+                self._data[offset:offset + 2] = bytes([0, len(chunk) + 1])
+            self._data[offset + 2:offset + 2 + len(chunk)] = chunk
+        link = bytes(self._data[entry:entry + 2])
+        first_track, first_sector = chain[0]
+        self.DIR_ENTRY.pack_into(
+            self._data, entry,
+            link[0], link[1],
+            FILE_CLOSED | file_type.value, first_track, first_sector,
+            encoded, bytes(9), len(chain)
+        )
+
+
+    def add_files(self, files):
+        """
+        write several files into the image.
+        :param files: iterable of (name, data, file type)
+        """
+        for name, data, file_type in files:
+            self.add_file(name, data, file_type=file_type)
+
+
+    def serialize(self, buffer):
+        buffer.write(self._data)
+
+
+    @staticmethod
+    def deserialize(buffer):
+        """
+        load a whole image into memory, so that it can be modified.
+        :param buffer: a binary buffer holding the image
+        :return: a D64Image or D81Image
+        """
+        data = bytearray(buffer.read())
+        cls = DiskImageType.from_size(len(data)).to_class()
+        # drop any trailing error information.
+        del data[cls.SIZE:]
+        return cls(data=data)
+
+
+class D64Image(DiskImage):
+
+    SIZE = 174848
+    TRACKS = 35
+    DIRECTORY_TRACK = 18
+    FIRST_DIRECTORY_SECTOR = 1
+    INTERLEAVE = 10
+    DIRECTORY_INTERLEAVE = 3
+    BAM_OFFSET = 0x04
+    NAME_OFFSET = 0x90
+    DOS_VERSION = 0x41
+    DOS_TYPE = b'2A'
+
+
+    @property
+    def image_type(self):
+        return DiskImageType.D64
+
+
+    @staticmethod
+    def sectors(track):
+        if track <= 17:
+            return 21
+        if track <= 24:
+            return 19
+        if track <= 30:
+            return 18
+        return 17
+
+
+    def _bam_entry(self, track):
+        return self.offset(self.DIRECTORY_TRACK, 0) + self.BAM_OFFSET + (track - 1) * 4
+
+
+    def _format(self, name, disk_id):
+        header = self.offset(self.DIRECTORY_TRACK, 0)
+        self._data[header:header + 4] = bytes([
+            self.DIRECTORY_TRACK, self.FIRST_DIRECTORY_SECTOR, self.DOS_VERSION, 0
+        ])
+        for track in range(1, self.TRACKS + 1):
+            self._free_track(track)
+        # disk name, two shifted spaces, disk id, shifted space, dos type,
+        # four shifted spaces.
+        self._data[header + self.NAME_OFFSET:header + 0xAB] = (
+            _pad(name, MAX_NAME_SIZE) + bytes([NAME_PAD] * 2) +
+            _pad(disk_id, DISK_ID_SIZE) + bytes([NAME_PAD]) +
+            self.DOS_TYPE + bytes([NAME_PAD] * 4)
+        )
+        directory = self.offset(self.DIRECTORY_TRACK, self.FIRST_DIRECTORY_SECTOR)
+        self._data[directory:directory + 2] = b'\x00\xff'
+        self._set_free(self.DIRECTORY_TRACK, 0, False)
+        self._set_free(self.DIRECTORY_TRACK, self.FIRST_DIRECTORY_SECTOR, False)
+
+
+class D81Image(DiskImage):
+
+    SIZE = 819200
+    TRACKS = 80
+    DIRECTORY_TRACK = 40
+    FIRST_DIRECTORY_SECTOR = 3
+    INTERLEAVE = 1
+    DIRECTORY_INTERLEAVE = 1
+    BAM_SECTORS = (1, 2)
+    BAM_OFFSET = 0x10
+    NAME_OFFSET = 0x04
+    DOS_VERSION = 0x44
+    DOS_TYPE = b'3D'
+
+
+    @property
+    def image_type(self):
+        return DiskImageType.D81
+
+
+    @staticmethod
+    def sectors(track):
+        return 40
+
+
+    def _bam_entry(self, track):
+        # each bam sector covers 40 tracks.
+        sector = self.BAM_SECTORS[(track - 1) // 40]
+        return self.offset(self.DIRECTORY_TRACK, sector) + self.BAM_OFFSET + ((track - 1) % 40) * 6
+
+
+    def _format(self, name, disk_id):
+        header = self.offset(self.DIRECTORY_TRACK, 0)
+        self._data[header:header + 4] = bytes([
+            self.DIRECTORY_TRACK, self.FIRST_DIRECTORY_SECTOR, self.DOS_VERSION, 0
+        ])
+        self._data[header + self.NAME_OFFSET:header + 0x1D] = (
+            _pad(name, MAX_NAME_SIZE) + bytes([NAME_PAD] * 2) +
+            _pad(disk_id, DISK_ID_SIZE) + bytes([NAME_PAD]) +
+            self.DOS_TYPE + bytes([NAME_PAD] * 2)
+        )
+        first, second = self.BAM_SECTORS
+        for sector, link in ((first, (self.DIRECTORY_TRACK, second)), (second, (0, 0xFF))):
+            bam = self.offset(self.DIRECTORY_TRACK, sector)
+            # link, version and its complement, disk id, i/o byte (verify on,
+            # check header crc), auto-boot flag.
+            self._data[bam:bam + 8] = (
+                bytes([link[0], link[1], self.DOS_VERSION, self.DOS_VERSION ^ 0xFF]) +
+                _pad(disk_id, DISK_ID_SIZE) + bytes([0xC0, 0])
+            )
+        for track in range(1, self.TRACKS + 1):
+            self._free_track(track)
+        directory = self.offset(self.DIRECTORY_TRACK, self.FIRST_DIRECTORY_SECTOR)
+        self._data[directory:directory + 2] = b'\x00\xff'
+        for sector in range(self.FIRST_DIRECTORY_SECTOR + 1):
+            self._set_free(self.DIRECTORY_TRACK, sector, False)
+
+
+DiskFileInfo = collections.namedtuple(
+    'DiskFileInfo', ['name', 'file_type', 'track', 'sector', 'blocks']
+)
+
+
+class DiskFileStream(io.RawIOBase):
+
+    def __init__(self, image, track, sector):
+        """
+        a read-only view of a file on a disk image. the sector chain is
+        followed lazily, as far as reads and seeks require, so opening a
+        file costs nothing and reading the start of a large one only visits
+        its first sectors.
+        :param image: the disk image
+        :param track: the file's first track
+        :param sector: the file's first sector
+        """
+        self._image = image
+        self._data = memoryview(image.data)
+        # the chain assembled so far: the image offset of each sector's
+        # contents, how many bytes it holds, and where it starts in the file.
+        self._offsets = []
+        self._lengths = []
+        self._starts = []
+        self._size = 0
+        self._next = (track, sector)
+        self._seen = set()
+        self._pos = 0
+
+
+    def _assemble(self, pos=None):
+        """
+        follow the sector chain until it covers a position in the file.
+        :param pos: the position, or None to follow the whole chain
+        """
+        data = self._data
+        while self._next is not None and (pos is None or pos >= self._size):
+            if self._next in self._seen:
+                raise ValueError('sector chain loops')
+            self._seen.add(self._next)
+            offset = self._image.offset(*self._next)
+            track, sector = data[offset], data[offset + 1]
+            if track:
+                length = SECTOR_DATA_SIZE
+                self._next = (track, sector)
+            else:
+                # the last sector's link holds the index of its last byte.
+                length = max(0, sector - 1)
+                self._next = None
+            self._offsets.append(offset + 2)
+            self._lengths.append(length)
+            self._starts.append(self._size)
+            self._size += length
+
+
+    @property
+    def size(self):
+        self._assemble()
+        return self._size
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self._pos
+
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError()
+        if pos < 0:
+            raise ValueError()
+        self._pos = pos
+        return self._pos
+
+
+    def readinto(self, b):
+        out = memoryview(b).cast('B')
+        self._assemble(self._pos + len(out) - 1)
+        count = 0
+        # every sector but the last is full, so the sector holding a
+        # position can be found by division.
+        i = self._pos // SECTOR_DATA_SIZE
+        while count < len(out) and i < len(self._offsets):
+            skip = self._pos - self._starts[i]
+            chunk = min(self._lengths[i] - skip, len(out) - count)
+            if chunk > 0:
+                start = self._offsets[i] + skip
+                out[count:count + chunk] = self._data[start:start + chunk]
+                count += chunk
+                self._pos += chunk
+            i += 1
+        return count
+
+
+    def close(self):
+        if not self.closed:
+            self._data.release()
+        super().close()
+
+
+class DiskReader:
+
+    def __init__(self, buffer):
+        """
+        index a disk image without extracting it. the directory is parsed
+        once; file contents are only read when a file is opened and read.
+        files are mapped into memory where possible.
+        :param buffer: a binary buffer holding the image
+        """
+        self._mmap = None
+        try:
+            self._mmap = mmap.mmap(buffer.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(self._mmap)
+        except (AttributeError, io.UnsupportedOperation):
+            data = memoryview(buffer.read())
+        cls = DiskImageType.from_size(len(data)).to_class()
+        self._view = data
+        # drop any trailing error information.
+        self._image = cls(data=data[:cls.SIZE])
+        self._index = collections.OrderedDict()
+        self._scan()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        """
+        release the image. streams previously handed out must be closed by
+        the caller first.
+        """
+        self._image.data.release()
+        self._image = None
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+    @property
+    def image(self):
+        return self._image
+
+
+    @property
+    def image_type(self):
+        return self._image.image_type
+
+
+    @property
+    def name(self):
+        return self._image.name
+
+
+    @property
+    def disk_id(self):
+        return self._image.disk_id
+
+
+    @property
+    def free_blocks(self):
+        return self._free_blocks
+
+
+    def _scan(self):
+        image = self._image
+        data = image.data
+        entries = []
+        for _, entry in image._iter_directory():
+            _, _, file_type, track, sector, name, _, blocks = \
+                DiskImage.DIR_ENTRY.unpack_from(data, entry)
+            # scratched files and unused entries have no type.
+            if not file_type:
+                continue
+            try:
+                file_type = DiskFileType(file_type & 0x07)
+            except ValueError:
+                # types 6 and 7 are not defined by cbm dos.
+                continue
+            entries.append((
+                name.rstrip(bytes([NAME_PAD])), file_type, track, sector,
+                blocks
+            ))
+        names = petscii.decode_all(entry[0] for entry in entries)
+        for name, (_, file_type, track, sector, blocks) in zip(names, entries):
+            self._index[name] = DiskFileInfo(name, file_type, track, sector, blocks)
+        self._free_blocks = image.free_blocks
+
+
+    def list(self):
+        """
+        get the name of every file on the disk, in directory order.
+        :return: list of names
+        """
+        return list(self._index)
+
+
+    def stat(self, name):
+        """
+        look up a file by name.
+        :param name: the file name
+        :return: the file's directory entry
+        """
+        return self._index[name]
+
+
+    def open(self, name):
+        """
+        get a file-like view of a file's contents. the result is seekable,
+        so an archive on the disk can be handed straight to CarReader.
+        :param name: the file name
+        :return: a readable, seekable stream
+        """
+        info = self.stat(name)
+        if info.file_type == DiskFileType.CBM:
+            # a partition's sectors are contiguous, not linked.
+            raise IsADirectoryError(name)
+        return DiskFileStream(self._image, info.track, info.sector)
+
+
+    def read(self, name):
+        """
+        get the contents of a file.
+        :param name: the file name
+        :return: the file's contents
+        """
+        with self.open(name) as f:
+            return f.read()
+
+
+def _pad(s, size):
+    encoded = petscii.encode(s)[:size]
+    return encoded.ljust(size, bytes([NAME_PAD]))
+
+
+def _unpad(data):
+    return petscii.decode(bytes(data).rstrip(bytes([NAME_PAD])))
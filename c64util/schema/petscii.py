@@ -0,0 +1,99 @@
+import cbmcodecs2
+
+
+LC_CODEC = 'petscii_c64en_lc'
+
+
+# petscii is a single-byte character set, so cbmcodecs2's charmap can be
+# flattened into translation tables once and applied with str.translate.
+# bytes are carried through str.translate as latin-1 characters.
+
+class _StrictTable(dict):
+
+    def __missing__(self, key):
+        # str.translate deletes characters mapped to None, which lets the
+        # caller spot anything the table could not translate.
+        return None
+
+
+def _build_tables():
+    decode_table = _StrictTable()
+    encode_table = _StrictTable()
+    for value in range(256):
+        try:
+            c = bytes([value]).decode(LC_CODEC)
+        except UnicodeDecodeError:
+            continue
+        decode_table[value] = c
+    for c in set(decode_table.values()):
+        b = c.encode(LC_CODEC)
+        if len(b) == 1:
+            encode_table[ord(c)] = chr(b[0])
+    return decode_table, encode_table
+
+
+_DECODE_TABLE, _ENCODE_TABLE = _build_tables()
+
+
+def encode(s):
+    """
+    encode a string as petscii.
+    :param s: the string
+    :return: the encoded bytes
+    """
+    translated = s.translate(_ENCODE_TABLE)
+    if len(translated) != len(s):
+        return s.encode(LC_CODEC)
+    return translated.encode('latin-1')
+
+
+def decode(data):
+    """
+    decode petscii bytes into a string.
+    :param data: a bytes-like object
+    :return: the decoded string
+    """
+    data = bytes(data)
+    translated = data.decode('latin-1').translate(_DECODE_TABLE)
+    if len(translated) != len(data):
+        return data.decode(LC_CODEC)
+    return translated
+
+
+def encode_all(strings):
+    """
+    encode many strings as petscii with a single translation.
+    :param strings: an iterable of strings
+    :return: list of encoded bytes, in the same order
+    """
+    strings = list(strings)
+    joined = ''.join(strings)
+    translated = joined.translate(_ENCODE_TABLE)
+    if len(translated) != len(joined):
+        return [ encode(s) for s in strings ]
+    data = translated.encode('latin-1')
+    encoded = []
+    pos = 0
+    for s in strings:
+        encoded.append(data[pos:pos+len(s)])
+        pos += len(s)
+    return encoded
+
+
+def decode_all(blocks):
+    """
+    decode many blocks of petscii bytes with a single translation.
+    :param blocks: an iterable of bytes-like objects
+    :return: list of decoded strings, in the same order
+    """
+    blocks = [ bytes(block) for block in blocks ]
+    joined = b''.join(blocks)
+    translated = joined.decode('latin-1').translate(_DECODE_TABLE)
+    if len(translated) != len(joined):
+        return [ decode(block) for block in blocks ]
+    decoded = []
+    pos = 0
+    for block in blocks:
+        decoded.append(translated[pos:pos+len(block)])
+        pos += len(block)
+    return decoded
@@ -0,0 +1,7 @@
+import os
+import sys
+
+
+# the utilities are run as scripts from the c64util directory, and import
+# the schema package from there.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
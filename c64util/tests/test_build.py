@@ -0,0 +1,34 @@
+import json
+
+from build import build_project, main
+from schema.car import CarReader
+
+
+def _project(tmp_path, **project):
+    path = tmp_path / 'project.json'
+    path.write_text(json.dumps(project))
+    return str(path)
+
+
+def test_prefix_defaults_to_name(tmp_path):
+    (tmp_path / 'main.o').write_bytes(b'\x00\x10')
+    path = _project(
+        tmp_path, name='app', version='1.0', archive='app.car',
+        files=['main.o'], index='app.car.json'
+    )
+    build_project(path)
+    # the second build copies main.o across from the first.
+    build_project(path)
+    with open(tmp_path / 'app.car', 'rb') as f:
+        reader = CarReader(f)
+        assert reader.list() == [ 'app', 'app/main.o', 'app/about.t' ]
+        assert reader.read('app/main.o') == b'\x00\x10'
+
+
+def test_failures_are_reported(tmp_path, capsys):
+    missing = _project(
+        tmp_path, name='app', version='1.0', archive='app.car',
+        files=['missing.o']
+    )
+    assert not main([ missing ], None, None)
+    assert 'missing.o' in capsys.readouterr().err
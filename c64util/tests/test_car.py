@@ -0,0 +1,122 @@
+import io
+
+import pytest
+
+from schema.car import (
+    CarArchive,
+    CarCompressionType,
+    CarMemberTable,
+    CarReader,
+    CarRecordType,
+    UnsupportedCompressionError,
+)
+
+
+def _table(paths):
+    table = CarMemberTable()
+    rows = {}
+    for path in paths:
+        parent, _, name = path.rpartition('/')
+        record_type = CarRecordType.PRGFILE
+        if any(other.startswith(path + '/') for other in paths):
+            record_type = CarRecordType.DIRECTORY
+        rows[path] = table.append(
+            rows.get(parent, -1), name, record_type, CarCompressionType.NONE,
+            len(path), len(rows)
+        )
+    return table, rows
+
+
+PATHS = [
+    'root',
+    'root/b',
+    'root/b/a',
+    'root/b/a b',
+    'root/a',
+    'root/a/b',
+    'root/a b',
+    'root/z',
+    'root/z/z',
+    'root/z/z/z',
+]
+
+
+def test_member_table_lookup():
+    table, rows = _table(PATHS)
+    assert list(table) == PATHS
+    for path in PATHS:
+        assert table.row(path) == rows[path]
+        info = table[path]
+        assert info.path == path
+        assert info.size == len(path)
+
+
+@pytest.mark.parametrize('path', [
+    '', 'root/', 'root/c', 'b', 'root/b/b', 'root/z/z/z/z', 'root/a/a b', 1,
+])
+def test_member_table_missing(path):
+    table, _ = _table(PATHS)
+    assert path not in table
+    with pytest.raises(KeyError):
+        table[path]
+
+
+def test_archive_round_trip():
+    archive = CarArchive()
+    archive.manifest.add_data('about.t', b'about', prefix='app')
+    archive.manifest.add_data('data/tile.bin', bytes(300), prefix='app')
+    buffer = io.BytesIO()
+    archive.serialize(buffer)
+    reader = CarReader(io.BytesIO(buffer.getvalue()))
+    assert reader.list() == [ 'app', 'app/about.t', 'app/data', 'app/data/tile.bin' ]
+    assert reader.read_all() == {
+        'app/about.t': b'about',
+        'app/data/tile.bin': bytes(300),
+    }
+
+
+def test_long_names_are_refused(tmp_path):
+    archive = CarArchive()
+    with pytest.raises(ValueError, match='app/backgroundtile001.bin'):
+        archive.manifest.add_data('backgroundtile001.bin', b'', prefix='app')
+    (tmp_path / 'app').mkdir()
+    (tmp_path / 'app' / 'backgroundtile002.bin').write_bytes(b'')
+    with pytest.raises(ValueError, match='app/backgroundtile002.bin'):
+        archive.manifest.add_tree(tmp_path / 'app', base_dir=tmp_path)
+
+
+def test_reader_refuses_escaping_names():
+    archive = CarArchive()
+    archive.manifest.add_data('../../evil', b'x')
+    buffer = io.BytesIO()
+    archive.serialize(buffer)
+    with pytest.raises(ValueError):
+        CarReader(io.BytesIO(buffer.getvalue()))
+
+
+@pytest.mark.parametrize('compression_type', [
+    CarCompressionType.RLE, CarCompressionType.LZ,
+])
+def test_unsupported_compression(compression_type, tmp_path):
+    archive = CarArchive()
+    archive.manifest.add_data('app/x.bin', b'', compression_type=compression_type)
+    # c64 os's compressed payloads can only be copied across, as they are.
+    payloads = {
+        full_path: b'\x01\x02stored'
+        for name, full_path, _ in archive.manifest._iterate_paths(
+            archive.manifest.root, archive.base_dir
+        )
+        if name == 'app/x.bin'
+    }
+    buffer = io.BytesIO()
+    archive.serialize(buffer, payloads=payloads)
+    reader = CarReader(io.BytesIO(buffer.getvalue()))
+    assert reader.stat('app/x.bin').compression_type == compression_type
+    assert reader.open('app/x.bin').read() == b'\x01\x02stored'
+    with pytest.raises(UnsupportedCompressionError):
+        reader.read('app/x.bin')
+    with pytest.raises(UnsupportedCompressionError):
+        reader.extractall(tmp_path / 'out')
+    assert not (tmp_path / 'out').exists()
+    with pytest.raises(UnsupportedCompressionError):
+        CarCompressionType.for_writing(compression_type.name.lower())
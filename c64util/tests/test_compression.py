@@ -0,0 +1,61 @@
+import os
+import random
+
+import pytest
+
+from schema import compression
+
+
+def _samples():
+    rng = random.Random(64)
+    return [
+        b'',
+        b'a',
+        b'ab',
+        b'aaa',
+        b'\x00' * 1000,
+        b'ab' * 500,
+        bytes(rng.randrange(256) for _ in range(2000)),
+        bytes(rng.choice(b'\x00\x00\x00\xff') for _ in range(5000)),
+        b'\x00' * 127 + b'\x01' + b'\x00' * 129 + b'\x02' * 300,
+        open(__file__, 'rb').read() * 3,
+    ]
+
+
+@pytest.mark.parametrize('data', _samples())
+def test_rle_round_trip(data):
+    assert compression.rle_decode(compression.rle_encode(data)) == data
+
+
+@pytest.mark.parametrize('data', _samples())
+def test_lz_round_trip(data):
+    assert compression.lz_decode(compression.lz_encode(data)) == data
+
+
+@pytest.mark.skipif(compression.numpy is None, reason='numpy is not installed')
+@pytest.mark.parametrize('data', [ d for d in _samples() if d ])
+def test_rle_run_detection_paths_agree(data):
+    assert compression._find_runs_numpy(data) == compression._find_runs_python(data)
+
+
+def test_rle_encodes_runs_compactly():
+    assert len(compression.rle_encode(b'\x00' * 1000)) < 20
+
+
+def test_lz_overlapping_match():
+    data = b'abc' + b'abc' * 200
+    encoded = compression.lz_encode(data)
+    assert len(encoded) < len(data) // 10
+    assert compression.lz_decode(encoded) == data
+
+
+@pytest.mark.parametrize('data', [ b'\x05a', b'\xfe' ])
+def test_rle_rejects_truncated_packets(data):
+    with pytest.raises(ValueError):
+        compression.rle_decode(data)
+
+
+@pytest.mark.parametrize('data', [ b'\x05a', b'\x80\x01', b'\x00a\x80\x05\x00' ])
+def test_lz_rejects_bad_packets(data):
+    with pytest.raises(ValueError):
+        compression.lz_decode(data)
@@ -0,0 +1,104 @@
+import io
+import os
+
+import pytest
+
+from schema.disk import (
+    D64Image,
+    D81Image,
+    DiskFileType,
+    DiskImageType,
+    DiskReader,
+)
+from schema import petscii
+
+
+def _round_trip(image):
+    buffer = io.BytesIO()
+    image.serialize(buffer)
+    return DiskReader(io.BytesIO(buffer.getvalue()))
+
+
+@pytest.mark.parametrize('cls', [ D64Image, D81Image ])
+def test_write_then_read(cls):
+    files = [
+        ('empty', b'', DiskFileType.SEQ),
+        ('one block', os.urandom(254), DiskFileType.PRG),
+        ('two blocks', os.urandom(255), DiskFileType.PRG),
+        ('large', os.urandom(40000), DiskFileType.USR),
+    ]
+    image = cls(name='test disk', disk_id='ab')
+    free = image.free_blocks
+    image.add_files(files)
+    with _round_trip(image) as disk:
+        assert disk.image_type == image.image_type
+        assert disk.name == 'test disk'
+        assert disk.disk_id == 'ab'
+        assert disk.list() == [ name for name, _, _ in files ]
+        for name, data, file_type in files:
+            assert disk.stat(name).file_type == file_type
+            assert disk.read(name) == data
+        assert disk.free_blocks == free - sum(
+            disk.stat(name).blocks for name, _, _ in files
+        )
+
+
+def test_stream_seeks():
+    data = os.urandom(3000)
+    image = D64Image()
+    image.add_file('data', data)
+    with _round_trip(image) as disk:
+        with disk.open('data') as f:
+            f.seek(1000)
+            assert f.read(600) == data[1000:1600]
+            f.seek(-10, io.SEEK_END)
+            assert f.read() == data[-10:]
+
+
+def test_image_type_from_size():
+    assert DiskImageType.from_size(D64Image.SIZE) == DiskImageType.D64
+    assert DiskImageType.from_size(D81Image.SIZE) == DiskImageType.D81
+
+
+def test_other_file_types():
+    image = D81Image()
+    image.add_files([
+        (name, b'x', DiskFileType.PRG) for name in ('part', 'odd', 'file')
+    ])
+    buffer = io.BytesIO()
+    image.serialize(buffer)
+    data = bytearray(buffer.getvalue())
+    # the file type is three bytes ahead of the name in a directory entry.
+    data[data.index(petscii.encode('part')) - 3] = 0x80 | DiskFileType.CBM.value
+    data[data.index(petscii.encode('odd')) - 3] = 0x86
+    with DiskReader(io.BytesIO(bytes(data))) as disk:
+        assert disk.list() == [ 'part', 'file' ]
+        assert disk.stat('part').file_type == DiskFileType.CBM
+        with pytest.raises(IsADirectoryError):
+            disk.open('part')
+        assert disk.read('file') == b'x'
+
+
+def test_duplicate_name():
+    image = D64Image()
+    image.add_file('a', b'1')
+    with pytest.raises(ValueError):
+        image.add_file('a', b'2')
+
+
+def test_disk_full():
+    image = D64Image()
+    with pytest.raises(ValueError, match='disk full'):
+        image.add_file('huge', bytes(image.free_blocks * 254 + 1))
+
+
+@pytest.mark.parametrize('cls, entries', [ (D64Image, 144), (D81Image, 296) ])
+def test_directory_full(cls, entries):
+    image = cls()
+    for i in range(entries):
+        image.add_file(f'f{i}', b'x')
+    with pytest.raises(ValueError, match='directory full'):
+        image.add_file('one more', b'x')
+    with _round_trip(image) as disk:
+        assert len(disk.list()) == entries
+        assert disk.read(f'f{entries - 1}') == b'x'
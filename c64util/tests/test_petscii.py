@@ -0,0 +1,51 @@
+import cbmcodecs2
+import pytest
+
+from schema import petscii
+
+
+def _codec_encode(c):
+    try:
+        return c.encode(petscii.LC_CODEC)
+    except UnicodeEncodeError:
+        return None
+
+
+def _table_encode(c):
+    try:
+        return petscii.encode(c)
+    except UnicodeEncodeError:
+        return None
+
+
+def test_decode_matches_codec():
+    for value in range(256):
+        data = bytes([value])
+        try:
+            expected = data.decode(petscii.LC_CODEC)
+        except UnicodeDecodeError:
+            with pytest.raises(UnicodeDecodeError):
+                petscii.decode(data)
+            continue
+        assert petscii.decode(data) == expected, value
+
+
+def test_encode_matches_codec():
+    for code_point in range(0x10000):
+        c = chr(code_point)
+        assert _table_encode(c) == _codec_encode(c), hex(code_point)
+
+
+def test_batches_match_single_calls():
+    names = [ 'about.t', 'Menu.m', '', 'main.o', 'BACKDROPS', 'x' * 16 ]
+    encoded = petscii.encode_all(names)
+    assert encoded == [ petscii.encode(name) for name in names ]
+    assert petscii.decode_all(encoded) == names
+
+
+def test_batches_fall_back_to_codec():
+    # a character the tables do not hold (u+fffe only encodes, so it is
+    # not in the decode table they are built from) sends the whole batch
+    # through the codec, which must still agree with single calls.
+    names = [ 'a', '\ufffe', 'b' ]
+    assert petscii.encode_all(names) == [ petscii.encode(name) for name in names ]
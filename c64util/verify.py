@@ -0,0 +1,113 @@
+import concurrent.futures
+import json
+import os
+import struct
+
+from catalog import find_archives
+from schema.car import CarCompressionType, CarReader, CarRecordType
+
+
+# both commands only read archives: record headers are scanned with a
+# CarReader, and payloads are read only to check that they decompress.
+
+
+def _describe_header(reader):
+    header = reader.header
+    t = header.timestamp
+    return {
+        'type': header.archive_type.name.lower(),
+        'timestamp': f'{t.year:04}-{t.month:02}-{t.day:02} {t.hour:02}:{t.minute:02}',
+        'note': header.note,
+    }
+
+
+def verify_archive(path):
+    """
+    check the structure of an archive: the header's magic and version,
+    that every directory has as many children as it declares, that every
+    file's payload is present in full, that nothing follows the root record
+    and that compressed payloads decode (where the compression format is
+    supported; other members are listed as unchecked).
+    :param path: path to the archive
+    :return: a dictionary describing the result
+    """
+    result = { 'archive': path, 'ok': False, 'errors': [] }
+    try:
+        with open(path, 'rb') as f:
+            reader = CarReader(f)
+            result.update(_describe_header(reader))
+            end = os.fstat(f.fileno()).st_size
+            last = 0
+            paths = reader.list()
+            for member in paths:
+                info = reader.stat(member)
+                if info.record_type == CarRecordType.DIRECTORY:
+                    last = max(last, info.offset)
+                    continue
+                last = max(last, info.offset + info.size)
+                if info.compression_type == CarCompressionType.NONE:
+                    continue
+                if not info.compression_type.supported:
+                    # a format this tool cannot decode is not an error in
+                    # the archive; the member just goes unchecked.
+                    result.setdefault('unchecked', []).append(member)
+                    continue
+                try:
+                    reader.read(member)
+                except ValueError as e:
+                    result['errors'].append(f'{member}: cannot decompress: {e}')
+            if last < end:
+                result['errors'].append(f'{end - last} bytes of trailing data')
+            result['members'] = len(paths)
+    except (ValueError, KeyError, struct.error) as e:
+        result['errors'].append(str(e) or type(e).__name__)
+    except OSError as e:
+        result['errors'].append(str(e))
+    result['ok'] = not result['errors']
+    return result
+
+
+def list_archive(path):
+    """
+    describe an archive and its members.
+    :param path: path to the archive
+    :return: a dictionary describing the archive
+    """
+    result = { 'archive': path }
+    try:
+        with open(path, 'rb') as f:
+            reader = CarReader(f)
+            result.update(_describe_header(reader))
+            members = []
+            for member in reader.list():
+                info = reader.stat(member)
+                members.append({
+                    'path': member,
+                    'type': info.record_type.name.lower(),
+                    'compression': info.compression_type.name.lower(),
+                    'size': info.size,
+                })
+            result['members'] = members
+    except (ValueError, KeyError, struct.error, OSError) as e:
+        result['error'] = str(e) or type(e).__name__
+    return result
+
+
+def main(command, paths, jobs):
+    """
+    run verify or ls over archives and directories of archives, writing one
+    json line per archive.
+    :return: True if every archive was read (and, for verify, is valid)
+    """
+    fn = verify_archive if command == 'verify' else list_archive
+    ok = True
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for result in pool.map(fn, find_archives(paths), chunksize=16):
+            ok = ok and result.get('ok', 'error' not in result)
+            print(json.dumps(result))
+    return ok
+
+
+def add_arguments(parser):
+    parser.add_argument('paths', help='archives and/or directories containing them', nargs='+')
+    parser.add_argument('-j', '--jobs', help='number of processes (default cpu count)', type=int)